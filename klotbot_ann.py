@@ -0,0 +1,471 @@
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import numpy as np
+import streamlit as st
+
+# Lokalna kopija Pinecone namespace-ova (opisi, korice) za pretragu bez mreze.
+# Svaki namespace ima svoj direktorijum sa generacijama kao klotbot_catalog:
+#   vectors.npy        float32 N x D, redovi poredjani po IVF klasteru
+#   centroids.npy      float32 nlist x D
+#   list_offsets.npy   pocetak svakog klastera u vectors.npy
+#   records.jsonl      {"id": ..., "metadata": {...}} po redu, records_offsets.npy
+#   ids.json           id po redu, za fetch
+SEARCH_MODES = ("remote", "local", "fallback")
+ASSIGN_CHUNK = 16384
+
+
+def _read_current(path):
+    try:
+        with open(os.path.join(path, "CURRENT"), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def truncate(vectors, dimensions):
+    """
+    First `dimensions` components, renormalized (text-embedding-3 vectors are Matryoshka-trained).
+    """
+    return _normalize(np.asarray(vectors, dtype=np.float32)[..., :dimensions])
+
+
+def add_truncated_vectors(path, dimensions):
+    """
+    Writes vectors_<d>.npy and centroids_<d>.npy next to the full vectors of a generation,
+    keeping the same row order and IVF clusters.
+    """
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    centroids = np.load(os.path.join(path, "centroids.npy"))
+    for size in dimensions:
+        if size >= vectors.shape[1]:
+            continue
+        target = np.lib.format.open_memmap(os.path.join(path, f"vectors_{size}.npy"), mode="w+", dtype=np.float32, shape=(len(vectors), size))
+        for start in range(0, len(vectors), ASSIGN_CHUNK):
+            target[start:start + ASSIGN_CHUNK] = truncate(vectors[start:start + ASSIGN_CHUNK], size)
+        target.flush()
+        del target
+        np.save(os.path.join(path, f"centroids_{size}.npy"), truncate(centroids, size))
+
+
+def assign_clusters(vectors, centroids):
+    """
+    Returns the index of the most similar centroid for each row, computed in chunks.
+    """
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def train_ivf(vectors, nlist, iterations=10, sample_size=50000, seed=0):
+    """
+    Spherical k-means on a sample of `vectors`; returns nlist normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(len(vectors), sample_size), replace=False))], dtype=np.float32)
+    sample = _normalize(sample)
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign_clusters(sample, centroids)
+        order = np.argsort(assignment, kind="stable")
+        clusters, starts = np.unique(assignment[order], return_index=True)
+        # prazni klasteri zadrzavaju prethodni centroid
+        centroids[clusters] = np.add.reduceat(sample[order], starts, axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def matches_filter(metadata, filter):
+    """
+    Evaluates a Pinecone metadata filter ($eq, $ne, $in, $nin, $gt, $gte, $lt, $lte,
+    $exists, $and, $or) against one metadata dict. List values match if any element matches.
+    """
+    for field, condition in filter.items():
+        if field == "$and":
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        value = metadata.get(field)
+        values = value if isinstance(value, list) else [value]
+        for operator, expected in condition.items():
+            if operator == "$exists":
+                ok = (field in metadata) == bool(expected)
+            elif operator == "$eq":
+                ok = expected in values
+            elif operator == "$ne":
+                ok = expected not in values
+            elif operator == "$in":
+                ok = any(v in expected for v in values)
+            elif operator == "$nin":
+                ok = not any(v in expected for v in values)
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                try:
+                    ok = {"$gt": value > expected, "$gte": value >= expected,
+                          "$lt": value < expected, "$lte": value <= expected}[operator]
+                except TypeError:
+                    ok = False
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+            if not ok:
+                return False
+    return True
+
+
+def export_namespace(index, namespace, root=None, batch_size=100, nlist=None, dimensions=()):
+    """
+    Copies all vectors, ids and metadata of a Pinecone namespace into a new local generation
+    and builds its IVF index.
+
+    Args:
+        index: Pinecone index handle (needs `list` and `fetch`, i.e. a serverless index).
+        namespace (str): Namespace to export.
+        root (str, optional): Store directory (ANN_DIR, default 'ann').
+        nlist (int, optional): Number of IVF clusters; defaults to sqrt(N).
+        dimensions (tuple): Truncated sizes (e.g. 256, 512, 1024) to store next to the full vectors.
+
+    Returns:
+        dict: 'rows', 'dimensions', 'nlist' and 'path' of the written generation.
+    """
+    root = root if root is not None else os.getenv("ANN_DIR", "ann")
+    namespace_root = os.path.join(root, namespace)
+    os.makedirs(namespace_root, exist_ok=True)
+    current = _read_current(namespace_root)
+    generation = (current["generation"] + 1) if current else 1
+    path = os.path.join(namespace_root, f"gen-{generation}")
+    os.makedirs(path, exist_ok=True)
+
+    ids = [vector_id for page in index.list(namespace=namespace) for vector_id in page]
+    raw_path = os.path.join(path, "raw_vectors.npy")
+    raw, ids_written, record_offsets = None, [], [0]
+    with open(os.path.join(path, "raw_records.jsonl"), "wb") as records:
+        for start in range(0, len(ids), batch_size):
+            response = index.fetch(ids=ids[start:start + batch_size], namespace=namespace)
+            for vector_id, vector in response["vectors"].items():
+                if raw is None:
+                    raw = np.lib.format.open_memmap(raw_path, mode="w+", dtype=np.float32, shape=(len(ids), len(vector["values"])))
+                raw[len(ids_written)] = vector["values"]
+                metadata = vector["metadata"] if "metadata" in vector and vector["metadata"] else {}
+                line = json.dumps({"id": vector_id, "metadata": dict(metadata)}, ensure_ascii=False).encode("utf-8") + b"\n"
+                records.write(line)
+                record_offsets.append(record_offsets[-1] + len(line))
+                ids_written.append(vector_id)
+            if (start // batch_size) % 50 == 0:
+                print(f"{namespace}: {len(ids_written)}/{len(ids)}")
+    if raw is None:
+        raise ValueError(f"Namespace '{namespace}' is empty")
+    rows = len(ids_written)
+    raw = raw[:rows]
+
+    nlist = nlist or max(1, int(np.sqrt(rows)))
+    centroids = train_ivf(raw, nlist)
+    assignment = assign_clusters(raw, centroids)
+    order = np.argsort(assignment, kind="stable")
+    list_offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1)).astype(np.int64)
+
+    # prepisujemo redove po klasterima da bi probe citale susedne stranice
+    vectors = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+", dtype=np.float32, shape=raw.shape)
+    for start in range(0, rows, ASSIGN_CHUNK):
+        vectors[start:start + ASSIGN_CHUNK] = raw[order[start:start + ASSIGN_CHUNK]]
+    vectors.flush()
+    del vectors, raw
+
+    offsets = np.zeros(rows + 1, dtype=np.int64)
+    with open(os.path.join(path, "raw_records.jsonl"), "rb") as source, open(os.path.join(path, "records.jsonl"), "wb") as target:
+        for position, row in enumerate(order):
+            source.seek(record_offsets[row])
+            line = source.read(record_offsets[row + 1] - record_offsets[row])
+            target.write(line)
+            offsets[position + 1] = offsets[position] + len(line)
+    np.save(os.path.join(path, "records_offsets.npy"), offsets)
+    np.save(os.path.join(path, "centroids.npy"), centroids)
+    np.save(os.path.join(path, "list_offsets.npy"), list_offsets)
+    with open(os.path.join(path, "ids.json"), "w", encoding="utf-8") as file:
+        json.dump([ids_written[row] for row in order], file)
+    os.remove(raw_path)
+    os.remove(os.path.join(path, "raw_records.jsonl"))
+    add_truncated_vectors(path, dimensions)
+
+    manifest = {"generation": generation, "namespace": namespace, "rows": rows,
+                "dimensions": int(centroids.shape[1]), "nlist": int(len(centroids))}
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    tmp_path = os.path.join(namespace_root, "CURRENT.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, os.path.join(namespace_root, "CURRENT"))
+
+    for entry in os.listdir(namespace_root):
+        if entry.startswith("gen-") and int(entry[4:]) < generation - 1:
+            shutil.rmtree(os.path.join(namespace_root, entry), ignore_errors=True)
+    return dict(manifest, path=path)
+
+
+class LocalQueryResponse:
+    """
+    Minimal stand-in for Pinecone's QueryResponse: supports `to_dict()` and item access.
+    """
+
+    def __init__(self, matches, namespace):
+        self.matches = matches
+        self.namespace = namespace
+
+    def to_dict(self):
+        return {"matches": self.matches, "namespace": self.namespace}
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+
+class LocalVectorIndex:
+    """
+    In-process IVF index over the exported namespaces, queried like a Pinecone index.
+
+    Vectors are memory-mapped; a query scores the `nprobe` closest clusters, walks the
+    candidates from best to worst and decodes metadata only until `top_k` rows pass the
+    filter. If the filter leaves too few rows, all clusters are searched. Scores are dot
+    products, which equal cosine similarity for OpenAI embeddings. Sparse vectors are ignored.
+
+    With `search_dimensions` (ANN_SEARCH_DIMENSIONS, e.g. 256) the clusters are probed with
+    truncated, renormalized vectors and the best `rescore_candidates` rows are rescored with
+    the full vectors, so only a fraction of the full-size pages is read per query.
+
+    Example usage:
+    local = LocalVectorIndex("ann", nprobe=16, search_dimensions=512)
+    response = local.query(vector=dense, top_k=5, filter={"eBook": False}, namespace="opisi")
+    response.to_dict()["matches"]  # [{'id': ..., 'score': 0.61, 'metadata': {...}}, ...]
+    """
+
+    def __init__(self, root=None, nprobe=None, search_dimensions=None, rescore_candidates=None):
+        self.root = root if root is not None else os.getenv("ANN_DIR", "ann")
+        self.nprobe = nprobe if nprobe is not None else int(os.getenv("ANN_NPROBE", 16))
+        self.search_dimensions = search_dimensions if search_dimensions is not None else int(os.getenv("ANN_SEARCH_DIMENSIONS", 0))
+        self.rescore_candidates = rescore_candidates if rescore_candidates is not None else int(os.getenv("ANN_RESCORE_CANDIDATES", 50))
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def _store(self, namespace):
+        current = _read_current(os.path.join(self.root, namespace or ""))
+        if current is None:
+            return None
+        store = self._stores.get(namespace)
+        if store is not None and store["manifest"]["generation"] == current["generation"]:
+            return store
+        with self._lock:
+            path = os.path.join(self.root, namespace, f"gen-{current['generation']}")
+            store = {
+                "manifest": current,
+                "path": path,
+                "vectors": np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"),
+                "centroids": np.load(os.path.join(path, "centroids.npy")),
+                "list_offsets": np.load(os.path.join(path, "list_offsets.npy")),
+                "records_offsets": np.load(os.path.join(path, "records_offsets.npy"), mmap_mode="r"),
+                "rows_by_id": None,
+                "truncated": {},
+            }
+            for entry in os.listdir(path):
+                match = re.fullmatch(r"vectors_(\d+)\.npy", entry)
+                if match:
+                    size = int(match.group(1))
+                    store["truncated"][size] = (
+                        np.load(os.path.join(path, entry), mmap_mode="r"),
+                        np.load(os.path.join(path, f"centroids_{size}.npy")),
+                    )
+            self._stores[namespace] = store
+        return store
+
+    def has_namespace(self, namespace):
+        return self._store(namespace) is not None
+
+    def _records(self, store, rows):
+        offsets = store["records_offsets"]
+        with open(os.path.join(store["path"], "records.jsonl"), "rb") as file:
+            for row in rows:
+                file.seek(int(offsets[row]))
+                yield row, json.loads(file.read(int(offsets[row + 1] - offsets[row])))
+
+    def _search(self, store, vector, top_k, filter, nprobe):
+        full_dimensions = store["vectors"].shape[1]
+        if len(vector) < full_dimensions:
+            # upit je vec skracen, pa nema punog vektora za rescoring
+            if len(vector) not in store["truncated"]:
+                raise ValueError(f"No {len(vector)}-dimensional vectors in the local store")
+            dimensions, rescore = len(vector), False
+        else:
+            dimensions = self.search_dimensions if self.search_dimensions in store["truncated"] else None
+            rescore = dimensions is not None
+        if dimensions:
+            query = truncate(vector, dimensions)
+            vectors, centroids = store["truncated"][dimensions]
+        else:
+            query, vectors, centroids = vector, store["vectors"], store["centroids"]
+        limit = max(self.rescore_candidates, top_k) if rescore else top_k
+
+        list_offsets = store["list_offsets"]
+        probes = np.argsort(centroids @ query)[::-1][:nprobe]
+        rows = np.sort(np.concatenate([np.arange(list_offsets[c], list_offsets[c + 1]) for c in probes]))
+        if not len(rows):
+            return []
+        scores = vectors[rows] @ query
+        records = {}
+        if filter is None:
+            best = np.argpartition(-scores, min(limit, len(scores)) - 1)[:limit]
+            selected = best[np.argsort(-scores[best])]
+        else:
+            # metapodaci se citaju redom od najboljeg kandidata dok se ne skupi dovoljno redova
+            ranked = np.argsort(-scores)
+            selected = []
+            for i, (row, record) in zip(ranked, self._records(store, rows[ranked])):
+                if matches_filter(record["metadata"], filter):
+                    selected.append(i)
+                    records[row] = record
+                    if len(selected) == limit:
+                        break
+            selected = np.array(selected, dtype=np.int64)
+        if not len(selected):
+            return []
+
+        selected_rows, selected_scores = rows[selected], scores[selected]
+        if rescore:
+            # kandidati iz skracenih vektora se preuredjuju punim vektorima
+            selected_scores = store["vectors"][selected_rows] @ vector
+            order = np.argsort(-selected_scores)[:top_k]
+            selected_rows, selected_scores = selected_rows[order], selected_scores[order]
+        missing = [row for row in selected_rows if row not in records]
+        records.update(self._records(store, missing))
+        return [(records[row], float(score)) for row, score in zip(selected_rows, selected_scores)]
+
+    def query(self, vector=None, top_k=10, filter=None, namespace=None, include_metadata=True, include_values=False, **kwargs):
+        """
+        Returns the `top_k` most similar rows of `namespace` as a LocalQueryResponse.
+
+        Raises:
+            LookupError: If the namespace was not exported.
+        """
+        store = self._store(namespace)
+        if store is None:
+            raise LookupError(f"No local ANN store for namespace '{namespace}'")
+        vector = np.asarray(vector, dtype=np.float32)
+        nlist = len(store["centroids"])
+        results = self._search(store, vector, top_k, filter, min(self.nprobe, nlist))
+        if len(results) < top_k and filter is not None and self.nprobe < nlist:
+            results = self._search(store, vector, top_k, filter, nlist)
+
+        matches = []
+        for record, score in results:
+            match = {"id": record["id"], "score": score}
+            if include_metadata:
+                match["metadata"] = record["metadata"]
+            matches.append(match)
+        if include_values:
+            for match, values in zip(matches, self._values(store, [m["id"] for m in matches])):
+                match["values"] = values
+        return LocalQueryResponse(matches, namespace)
+
+    def _rows_by_id(self, store):
+        if store["rows_by_id"] is None:
+            with open(os.path.join(store["path"], "ids.json"), "r", encoding="utf-8") as file:
+                store["rows_by_id"] = {vector_id: row for row, vector_id in enumerate(json.load(file))}
+        return store["rows_by_id"]
+
+    def _values(self, store, ids):
+        rows_by_id = self._rows_by_id(store)
+        return [store["vectors"][rows_by_id[vector_id]].tolist() for vector_id in ids]
+
+    def fetch(self, ids, namespace=None):
+        """
+        Returns {'vectors': {id: {'id', 'values', 'metadata'}}, 'namespace'} like Pinecone's fetch.
+        """
+        store = self._store(namespace)
+        if store is None:
+            raise LookupError(f"No local ANN store for namespace '{namespace}'")
+        rows_by_id = self._rows_by_id(store)
+        rows = [rows_by_id[vector_id] for vector_id in ids if vector_id in rows_by_id]
+        vectors = {}
+        for row, record in self._records(store, rows):
+            vectors[record["id"]] = {"id": record["id"], "values": store["vectors"][row].tolist(), "metadata": record["metadata"]}
+        return {"vectors": vectors, "namespace": namespace}
+
+
+class SearchIndex:
+    """
+    Index handle that sends queries to the local ANN store, to Pinecone, or to the local
+    store with Pinecone as fallback (VECTOR_SEARCH_MODE = remote | local | fallback).
+
+    `remote` is a callable returning the Pinecone index, so local mode never connects.
+    Hybrid queries (with 'sparse_vector') go to Pinecone in fallback mode, because the
+    local store is dense-only. Everything else is delegated to the Pinecone index.
+    """
+
+    def __init__(self, remote, local=None, mode=None):
+        self.remote = remote
+        self.local = local
+        self.mode = mode if mode is not None else os.getenv("VECTOR_SEARCH_MODE", "remote")
+        if self.mode not in SEARCH_MODES:
+            raise ValueError(f"VECTOR_SEARCH_MODE must be one of {SEARCH_MODES}, got '{self.mode}'")
+
+    def _use_local(self, namespace, hybrid=False):
+        if self.mode == "remote" or self.local is None:
+            return False
+        if self.mode == "local":
+            return True
+        return not hybrid and self.local.has_namespace(namespace)
+
+    def query(self, **kwargs):
+        if self._use_local(kwargs.get("namespace"), hybrid=bool(kwargs.get("sparse_vector"))):
+            try:
+                return self.local.query(**kwargs)
+            except Exception as e:
+                if self.mode == "local":
+                    raise
+                print(f"Local ANN query failed, using Pinecone: {e}")
+        return self.remote().query(**kwargs)
+
+    def fetch(self, ids, namespace=None, **kwargs):
+        if self._use_local(namespace):
+            try:
+                return self.local.fetch(ids=ids, namespace=namespace)
+            except Exception as e:
+                if self.mode == "local":
+                    raise
+                print(f"Local ANN fetch failed, using Pinecone: {e}")
+        return self.remote().fetch(ids=ids, namespace=namespace, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.remote(), name)
+
+
+@st.cache_resource
+def get_local_index():
+    return LocalVectorIndex()
+
+
+if __name__ == "__main__":
+    # python klotbot_ann.py opisi korice [--dims 256,512,1024]
+    from klotbot_pinecone import DELFI_HOST, PineconeIndexRegistry
+
+    args = sys.argv[1:]
+    dims = ()
+    if "--dims" in args:
+        position = args.index("--dims")
+        dims = tuple(int(d) for d in args[position + 1].split(","))
+        del args[position:position + 2]
+    registry = PineconeIndexRegistry()
+    for name in args or ["opisi", "korice"]:
+        print(export_namespace(registry.get(DELFI_HOST, name), name, dimensions=dims))
@@ -0,0 +1,207 @@
+import json
+import os
+import re
+import sys
+import unicodedata
+from functools import lru_cache
+import streamlit as st
+from pinecone_text.sparse import BM25Encoder
+from klotbot_text import stem_terms
+
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "ђ": "dj", "е": "e", "ж": "z", "з": "z",
+    "и": "i", "ј": "j", "к": "k", "л": "l", "љ": "lj", "м": "m", "н": "n", "њ": "nj", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "ћ": "c", "у": "u", "ф": "f", "х": "h", "ц": "c",
+    "ч": "c", "џ": "dz", "ш": "s",
+}
+
+# Serbian stopwords, latinica bez dijakritika
+STOPWORDS = set("""
+a ako ali bi bih bila bile bili bilo bio biti da dali do dok ga gde i ih ili im imam imamo imate iz
+ja je jer jos joj ju kada kako kao koja koje koji kojeg kojoj kojom koliko li me mene meni mi
+mogu moze mu na nam nas ne neka neki neko nesto ni niti o od on ona one oni ono ova ovaj ove ovo
+pa po posle pre preko sa sam samo se si smo sta ste su sve svi ta taj tako tamo te ti to tu u uz
+vam vas vec vi za zasto
+""".split())
+
+
+class SerbianTokenizer:
+    """
+    Tokenizer for Serbian catalog text: Cyrillic is transliterated to Latin, diacritics are
+    folded (č/ć -> c, š -> s, ž -> z, đ -> dj), stopwords are removed and common case endings
+    are stripped, so "Karenjini" and "karenjina" produce the same token.
+
+    The attributes mirror pinecone_text's BM25Tokenizer so BM25Encoder.dump() keeps working.
+    """
+
+    lower_case = True
+    remove_punctuation = True
+    remove_stopwords = True
+    stem = True
+    language = "serbian"
+
+    def __call__(self, text):
+        text = "".join(CYRILLIC_TO_LATIN.get(c, c) for c in text.lower()).replace("đ", "dj")
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+        words = [word for word in re.findall(r"\w+", text) if word not in STOPWORDS and not word.isdigit()]
+        return [term for term in stem_terms(" ".join(words)) if len(term) > 1]
+
+
+class SerbianBM25Encoder(BM25Encoder):
+    """
+    BM25Encoder that always uses SerbianTokenizer, also after load(), and skips the NLTK setup.
+    """
+
+    def __init__(self, b=0.75, k1=1.2):
+        self.b = b
+        self.k1 = k1
+        self._tokenizer = SerbianTokenizer()
+        self.doc_freq = None
+        self.n_docs = None
+        self.avgdl = None
+
+    def set_params(self, avgdl, n_docs, doc_freq, b, k1, **tokenizer_params):
+        self.avgdl = avgdl
+        self.n_docs = n_docs
+        self.doc_freq = dict(zip(doc_freq["indices"], doc_freq["values"]))
+        self.b = b
+        self.k1 = k1
+        return self
+
+
+class SparseQueryEncoder:
+    """
+    Process-wide BM25 query encoder with an LRU of encoded queries.
+
+    Sparse query vectors only match documents whose sparse vectors were made with the same
+    tokenizer, so the encoder is chosen by BM25_ENCODER:
+
+    - 'legacy' (default): pinecone_text's BM25Encoder with its default tokenizer, the one that
+      produced the sparse vectors already in the index, with corpus parameters from
+      BM25_LEGACY_PARAMS_FILE (default 'bm25_legacy_params.json', made with
+      `python klotbot_bm25.py --fit-legacy <namespace>`). Without that file it falls back to
+      fitting on the query itself (flat IDF) and prints a warning.
+    - 'serbian': SerbianBM25Encoder with the corpus parameters from BM25_PARAMS_FILE (default
+      'bm25_params.json'). Switch to it only after the documents were re-encoded with
+      `python klotbot_bm25.py --reencode <namespace>`.
+
+    Example usage:
+    encoder = SparseQueryEncoder(mode="serbian", path="bm25_params.json")
+    encoder.encode_query("knjige o Drugom svetskom ratu")  # {"indices": [...], "values": [...]}
+    """
+
+    def __init__(self, path=None, cache_size=4096, mode=None, legacy_path=None):
+        self.path = path if path is not None else os.getenv("BM25_PARAMS_FILE", "bm25_params.json")
+        self.legacy_path = legacy_path if legacy_path is not None else os.getenv("BM25_LEGACY_PARAMS_FILE", "bm25_legacy_params.json")
+        self.mode = mode if mode is not None else os.getenv("BM25_ENCODER", "legacy")
+        self.encoder = None
+        params = self.path if self.mode == "serbian" else self.legacy_path
+        if os.path.exists(params):
+            # isti tokenizer i hesiranje kao sacuvani sparse vektori, ali IDF iz celog korpusa
+            self.encoder = (SerbianBM25Encoder() if self.mode == "serbian" else BM25Encoder()).load(params)
+        else:
+            print(f"Warning: BM25 params '{params}' not found, fitting on each query (flat IDF).")
+        self._encode = lru_cache(maxsize=cache_size)(self._encode_uncached)
+
+    def _encode_uncached(self, text):
+        if self.encoder is not None:
+            sparse = self.encoder.encode_queries(text)
+        elif self.mode == "serbian":
+            sparse = SerbianBM25Encoder().fit([text]).encode_queries(text)
+        else:
+            sparse = BM25Encoder().fit([text]).encode_queries(text)
+        return tuple(sparse["indices"]), tuple(sparse["values"])
+
+    def encode_query(self, text):
+        indices, values = self._encode(text)
+        return {"indices": list(indices), "values": list(values)}
+
+    def cache_info(self):
+        return self._encode.cache_info()
+
+
+def fit_bm25(texts, path, legacy=False):
+    """
+    Fits SerbianBM25Encoder (or, with `legacy`, the default-tokenizer BM25Encoder) on a corpus
+    and stores its parameters in `path`.
+    """
+    encoder = (BM25Encoder() if legacy else SerbianBM25Encoder()).fit(list(texts))
+    encoder.dump(path)
+    return encoder
+
+
+def namespace_texts(index, namespace, text_fields=("text", "description"), batch_size=100):
+    """
+    Yields (id, text) for every document in a namespace, the text taken from the first
+    non-empty metadata field in `text_fields`.
+    """
+    ids = [vector_id for page in index.list(namespace=namespace) for vector_id in page]
+    for start in range(0, len(ids), batch_size):
+        response = index.fetch(ids=ids[start:start + batch_size], namespace=namespace)
+        for vector_id, vector in response["vectors"].items():
+            metadata = vector["metadata"] if "metadata" in vector and vector["metadata"] else {}
+            yield vector_id, next((metadata[field] for field in text_fields if metadata.get(field)), "")
+        print(f"{namespace}: {min(start + batch_size, len(ids))}/{len(ids)}")
+
+
+def reencode_documents(index, namespace, encoder, text_fields=("text", "description"), batch_size=100):
+    """
+    Rewrites the sparse vectors of every document in a namespace with `encoder`, so they match
+    queries encoded with the same tokenizer. Dense vectors and metadata are left unchanged.
+
+    Args:
+        index: Pinecone index handle (needs `list`, `fetch` and `update`, i.e. a serverless index).
+        namespace (str): Namespace to re-encode.
+        encoder: Fitted BM25 encoder, e.g. SerbianBM25Encoder().load("bm25_params.json").
+        text_fields (tuple): Metadata fields tried in order for the document text.
+
+    Returns:
+        int: Number of updated documents.
+    """
+    updated = 0
+    for vector_id, text in namespace_texts(index, namespace, text_fields, batch_size):
+        sparse = encoder.encode_documents(text) if text else None
+        # Pinecone ne prihvata prazan sparse vektor
+        if not sparse or not sparse["indices"]:
+            continue
+        index.update(id=vector_id, sparse_values=sparse, namespace=namespace)
+        updated += 1
+    return updated
+
+
+@st.cache_resource
+def get_sparse_encoder():
+    return SparseQueryEncoder()
+
+
+if __name__ == "__main__":
+    # python klotbot_bm25.py opisi.jsonl [bm25_params.json]
+    # svaki red JSONL fajla je objekat sa poljem 'text' ili 'description'
+    # python klotbot_bm25.py --reencode <namespace> [bm25_params.json]
+    # ponovo kodira sparse vektore dokumenata u hibridnom indeksu; posle toga BM25_ENCODER=serbian
+    # python klotbot_bm25.py --fit-legacy <namespace> [bm25_legacy_params.json]
+    # fituje podrazumevani BM25Encoder na tekstovima namespace-a (bez ponovnog kodiranja dokumenata)
+    if sys.argv[1] == "--fit-legacy":
+        from klotbot_pinecone import NEO_POSITIVE_HOST, get_pinecone_registry
+        namespace = sys.argv[2]
+        target = sys.argv[3] if len(sys.argv) > 3 else "bm25_legacy_params.json"
+        index = get_pinecone_registry().get(NEO_POSITIVE_HOST, namespace)
+        corpus = [text for _, text in namespace_texts(index, namespace) if text]
+        fit_bm25(corpus, target, legacy=True)
+        print(f"Legacy BM25 params for {len(corpus)} documents written to {target}")
+        sys.exit(0)
+    if sys.argv[1] == "--reencode":
+        from klotbot_pinecone import NEO_POSITIVE_HOST, get_pinecone_registry
+        namespace = sys.argv[2]
+        params = sys.argv[3] if len(sys.argv) > 3 else "bm25_params.json"
+        index = get_pinecone_registry().get(NEO_POSITIVE_HOST, namespace)
+        updated = reencode_documents(index, namespace, SerbianBM25Encoder().load(params))
+        print(f"{updated} documents in '{namespace}' re-encoded; set BM25_ENCODER=serbian")
+        sys.exit(0)
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else "bm25_params.json"
+    with open(source, "r", encoding="utf-8-sig") as file:
+        rows = (json.loads(line) for line in file if line.strip())
+        corpus = [row.get("text") or row.get("description") or "" for row in rows]
+    fit_bm25([text for text in corpus if text], target)
+    print(f"BM25 params for {len(corpus)} documents written to {target}")
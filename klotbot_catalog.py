@@ -0,0 +1,335 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import neo4j
+
+# Lokalna kopija Book/Author/Genre podataka iz Neo4j-a. Kolone su .npy fajlovi
+# koji se otvaraju kao memory-map, pa svi Streamlit procesi dele iste stranice.
+NUMERIC_COLUMNS = {
+    "oldProductId": np.int64,
+    "price": np.float64,
+    "quantity": np.int32,
+    "pages": np.int32,
+    "eBook": np.int8,
+}
+STRING_COLUMNS = ["id", "title", "category", "authors", "genres"]
+LIST_COLUMNS = {"authors", "genres"}
+LIST_SEPARATOR = "\x1f"
+MISSING_INT = -1
+
+# {marker_filter} zavisi od tipa markera: broj, datetime ili string
+EXPORT_QUERY = """
+MATCH (b:Book)
+WHERE $marker IS NULL OR b[$marker_property] > {marker_filter}
+OPTIONAL MATCH (b)-[:WROTE]-(a:Author)
+OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:Genre)
+RETURN b.id AS id, b.oldProductId AS oldProductId, b.category AS category, b.title AS title,
+       b.price AS price, b.quantity AS quantity, b.pages AS pages, b.eBook AS eBook,
+       b[$marker_property] AS marker,
+       collect(DISTINCT a.name) AS authors, collect(DISTINCT g.name) AS genres
+"""
+
+# svi id-jevi iz grafa, da bi inkrementalno osvezavanje izbacilo obrisane knjige
+LIVE_IDS_QUERY = "MATCH (b:Book) RETURN b.id AS id"
+
+
+def _to_number(value, dtype):
+    if value is None or value == "":
+        return MISSING_INT
+    try:
+        if dtype is np.int8:
+            return 1 if str(value).lower() in ("true", "1", "yes") else 0
+        if dtype is np.float64:
+            return float(value)
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_INT
+
+
+def _write_strings(path, name, values):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(v) for v in encoded], dtype=np.int64)
+    np.save(os.path.join(path, f"{name}_offsets.npy"), offsets)
+    np.save(os.path.join(path, f"{name}_data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+def write_snapshot(root, rows, marker=None, marker_type=None):
+    """
+    Writes a new catalog generation under `root` and atomically makes it current.
+
+    Args:
+        root (str): Catalog directory.
+        rows (list): Book dicts with the NUMERIC_COLUMNS and STRING_COLUMNS keys.
+        marker: Highest change marker included in the snapshot.
+
+    Returns:
+        str: Path of the written generation.
+    """
+    os.makedirs(root, exist_ok=True)
+    current = _read_current(root)
+    generation = (current["generation"] + 1) if current else 1
+    path = os.path.join(root, f"gen-{generation}")
+    os.makedirs(path, exist_ok=True)
+
+    for name, dtype in NUMERIC_COLUMNS.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.array([_to_number(row.get(name), dtype) for row in rows], dtype=dtype))
+    for name in STRING_COLUMNS:
+        if name in LIST_COLUMNS:
+            values = [LIST_SEPARATOR.join(str(v) for v in row.get(name) or []) for row in rows]
+        else:
+            values = ["" if row.get(name) is None else str(row.get(name)) for row in rows]
+        _write_strings(path, name, values)
+
+    # indeksi: redovi sortirani po id-u i po oldProductId za binarnu pretragu
+    ids = ["" if row.get("id") is None else str(row.get("id")) for row in rows]
+    np.save(os.path.join(path, "id_order.npy"), np.array(sorted(range(len(ids)), key=ids.__getitem__), dtype=np.int32))
+    old_ids = np.load(os.path.join(path, "oldProductId.npy"))
+    np.save(os.path.join(path, "oldProductId_order.npy"), np.argsort(old_ids, kind="stable").astype(np.int32))
+
+    manifest = {"generation": generation, "rows": len(rows), "marker": marker, "marker_type": marker_type,
+                "exported_at": time.time()}
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    _write_current(root, manifest)
+
+    # zadrzavamo prethodnu generaciju za procese koji je jos citaju
+    for entry in os.listdir(root):
+        if entry.startswith("gen-") and int(entry[4:]) < generation - 1:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return path
+
+
+def _write_current(root, manifest):
+    tmp_path = os.path.join(root, "CURRENT.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, os.path.join(root, "CURRENT"))
+
+
+def _read_current(root):
+    try:
+        with open(os.path.join(root, "CURRENT"), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _marker_value(value):
+    """
+    Converts a change marker read from Neo4j into a JSON friendly value and its type.
+    """
+    if value is None:
+        return None, None
+    if hasattr(value, "iso_format"):
+        return value.iso_format(), "datetime"
+    if isinstance(value, (int, float)):
+        return value, "number"
+    return str(value), "string"
+
+
+def export_catalog(driver, root=None, marker_property=None, incremental=True):
+    """
+    Exports Book properties with their authors and genres from Neo4j into a catalog snapshot.
+
+    With `incremental=True` only books whose `marker_property` (default CATALOG_CHANGE_PROPERTY
+    or 'updatedAt') is newer than the last snapshot are read and merged into it, and books
+    no longer in the graph are removed. Without a previous marker the export is full.
+    `exported_at` in the manifest is refreshed on every run, also when nothing changed.
+
+    Returns:
+        dict: 'rows', 'changed', 'deleted' and 'marker' of the written snapshot.
+    """
+    root = root if root is not None else os.getenv("CATALOG_DIR", "catalog")
+    marker_property = marker_property or os.getenv("CATALOG_CHANGE_PROPERTY", "updatedAt")
+    current = _read_current(root)
+    marker = current["marker"] if incremental and current else None
+    marker_type = current.get("marker_type") if marker is not None else None
+    query = EXPORT_QUERY.replace("{marker_filter}", "datetime($marker)" if marker_type == "datetime" else "$marker")
+
+    with driver.session(fetch_size=1000) as session:
+        changed = [dict(record) for record in session.run(query, marker=marker, marker_property=marker_property)]
+        live_ids = {record["id"] for record in session.run(LIVE_IDS_QUERY)} if marker is not None else None
+
+    rows = {}
+    deleted = 0
+    if marker is not None:
+        mirror = CatalogMirror(root)
+        rows = {row["id"]: row for row in mirror.iter_rows() if row["id"] in live_ids}
+        deleted = mirror.rows - len(rows)
+        mirror.close()
+    new_marker = marker
+    for row in changed:
+        row_marker, row_marker_type = _marker_value(row.pop("marker", None))
+        if row_marker is not None and (new_marker is None or row_marker > new_marker):
+            new_marker, marker_type = row_marker, row_marker_type
+        rows[row["id"]] = row
+
+    if marker is not None and not changed and not deleted:
+        # podaci su potvrdjeni kao aktuelni, pomera se samo vreme izvoza
+        _write_current(root, dict(current, exported_at=time.time()))
+        return {"rows": len(rows), "changed": 0, "deleted": 0, "marker": marker}
+    write_snapshot(root, list(rows.values()), marker=new_marker, marker_type=marker_type)
+    return {"rows": len(rows), "changed": len(changed), "deleted": deleted, "marker": new_marker}
+
+
+class CatalogMirror:
+    """
+    Read-only, memory-mapped view of the latest catalog snapshot.
+
+    Lookups by `id` and `oldProductId` are binary searches over sorted row orders, so they
+    read only a few pages and need no per-process index. A newer snapshot is picked up by
+    `reload_if_changed`. Price and quantity are only as fresh as the last export; callers
+    check `is_fresh` before using them.
+
+    Example usage:
+    mirror = CatalogMirror("catalog")
+    mirror.get_many(["a1b2", "c3d4"])  # [{'id': 'a1b2', 'title': ..., 'authors': [...], ...}]
+    """
+
+    def __init__(self, root=None):
+        self.root = root if root is not None else os.getenv("CATALOG_DIR", "catalog")
+        self.manifest = None
+        self.columns = {}
+        self._lock = threading.Lock()
+        self.reload_if_changed()
+
+    @property
+    def rows(self):
+        return self.manifest["rows"] if self.manifest else 0
+
+    def reload_if_changed(self):
+        """
+        Opens the current generation if it differs from the one mapped. Returns True on reload.
+        """
+        current = _read_current(self.root)
+        if current is None:
+            return False
+        if self.manifest and current["generation"] == self.manifest["generation"]:
+            with self._lock:
+                self.manifest = current  # isti podaci, novije vreme izvoza
+            return False
+        path = os.path.join(self.root, f"gen-{current['generation']}")
+        columns = {}
+        for name in list(NUMERIC_COLUMNS) + ["id_order", "oldProductId_order"]:
+            columns[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in STRING_COLUMNS:
+            columns[f"{name}_offsets"] = np.load(os.path.join(path, f"{name}_offsets.npy"), mmap_mode="r")
+            columns[f"{name}_data"] = np.load(os.path.join(path, f"{name}_data.npy"), mmap_mode="r")
+        with self._lock:
+            self.columns = columns
+            self.manifest = current
+        return True
+
+    def close(self):
+        with self._lock:
+            self.columns = {}
+            self.manifest = None
+
+    def age(self):
+        """
+        Seconds since the mapped snapshot was exported (infinite if unknown).
+        """
+        manifest = self.manifest
+        if not manifest or manifest.get("exported_at") is None:
+            return float("inf")
+        return max(0.0, time.time() - manifest["exported_at"])
+
+    def is_fresh(self, max_age=None):
+        """
+        True if price and quantity in the snapshot are recent enough to show
+        (CATALOG_MAX_AGE, default 300 s like the Neo4j BookCache TTL).
+        """
+        max_age = max_age if max_age is not None else float(os.getenv("CATALOG_MAX_AGE", 300))
+        return self.age() <= max_age
+
+    def _string(self, columns, name, row):
+        offsets = columns[f"{name}_offsets"]
+        return bytes(columns[f"{name}_data"][offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def _row(self, columns, row):
+        record = {}
+        for name in STRING_COLUMNS:
+            value = self._string(columns, name, row)
+            if name in LIST_COLUMNS:
+                record[name] = value.split(LIST_SEPARATOR) if value else []
+            else:
+                record[name] = value or None
+        for name, dtype in NUMERIC_COLUMNS.items():
+            value = columns[name][row].item()
+            # nedostajuca vrednost se proverava pre konverzije, inace bi -1 postao True
+            if value == MISSING_INT:
+                record[name] = None
+            else:
+                record[name] = bool(value) if dtype is np.int8 else value
+        return record
+
+    def _find_id(self, columns, book_id):
+        order = columns["id_order"]
+        low, high = 0, len(order)
+        while low < high:
+            mid = (low + high) // 2
+            if self._string(columns, "id", order[mid]) < book_id:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(order) and self._string(columns, "id", order[low]) == book_id:
+            return int(order[low])
+        return None
+
+    def get_by_id(self, book_id):
+        with self._lock:
+            columns = self.columns
+        if not columns:
+            return None
+        row = self._find_id(columns, str(book_id))
+        return self._row(columns, row) if row is not None else None
+
+    def get_many(self, ids):
+        """
+        Returns records for the given ids in input order, skipping unknown ids.
+        """
+        with self._lock:
+            columns = self.columns
+        if not columns:
+            return []
+        rows = [self._find_id(columns, str(book_id)) for book_id in ids]
+        return [self._row(columns, row) for row in rows if row is not None]
+
+    def get_by_old_product_id(self, old_product_id):
+        with self._lock:
+            columns = self.columns
+        if not columns:
+            return None
+        try:
+            old_product_id = int(old_product_id)
+        except (TypeError, ValueError):
+            return None
+        values, order = columns["oldProductId"], columns["oldProductId_order"]
+        low, high = 0, len(order)
+        while low < high:
+            mid = (low + high) // 2
+            if values[order[mid]] < old_product_id:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(order) and values[order[low]] == old_product_id:
+            return self._row(columns, int(order[low]))
+        return None
+
+    def iter_rows(self):
+        with self._lock:
+            columns = self.columns
+        for row in range(self.rows):
+            yield self._row(columns, row)
+
+
+if __name__ == "__main__":
+    # osvezavanje kopije (npr. iz cron-a): python klotbot_catalog.py [--full]
+    import sys
+    driver = neo4j.GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASS")))
+    print(export_catalog(driver, incremental="--full" not in sys.argv))
+    driver.close()
@@ -0,0 +1,143 @@
+import os
+import re
+import streamlit as st
+import tiktoken
+
+# granica recenice: tacka, uzvicnik, upitnik ili tri tacke pa razmak ili novi red; razmak se cuva
+SENTENCE_END = re.compile(r"(?<=[.!?…])(\s+)")
+BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+# red oblika "Title: ...", "Content (opisi): ..." zapocinje novo polje rezultata alata
+FIELD_LABEL = re.compile(r"^[A-Z][\w ()]{0,30}:\s?")
+# polja sa dugim tekstom koja se skracuju; ostala polja (Title, Link, URL...) ostaju cela
+TRIM_FIELDS = ("Description", "Content", "Opis")
+
+
+class ContextAssembler:
+    """
+    Packs retrieval results into a context of at most `budget` tokens.
+
+    Items are (text, score) pairs or plain strings; strings are split into blocks on blank
+    lines and keep their order. Items are taken best score first. Each item is first cut to
+    `max_item_tokens`; an item that does not fit the remaining budget is trimmed at a sentence
+    boundary if at least `min_item_tokens` remain, otherwise it is dropped.
+
+    Attributes:
+        budget (int): Token budget of the packed context (CONTEXT_TOKEN_BUDGET, default 3000).
+        max_item_tokens (int): Cap for a single item (CONTEXT_MAX_ITEM_TOKENS, default 800).
+
+    Example usage:
+    assembler = ContextAssembler(budget=2000)
+    context, stats = assembler.assemble([("Opis prve knjige...", 0.82), ("Opis druge...", 0.41)])
+    # stats: {'tokens': 1874, 'items': 2, 'dropped': 0, 'trimmed': 1, 'score_cutoff': 0.41}
+    """
+
+    def __init__(self, budget=None, max_item_tokens=None, min_item_tokens=40, model="gpt-4o"):
+        self.budget = budget if budget is not None else int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+        self.max_item_tokens = max_item_tokens if max_item_tokens is not None else int(os.getenv("CONTEXT_MAX_ITEM_TOKENS", 800))
+        self.min_item_tokens = min_item_tokens
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _trim_sentences(self, text, max_tokens):
+        kept, used = "", 0
+        pieces = SENTENCE_END.split(text)  # recenica, razmak, recenica, ...
+        for position in range(0, len(pieces), 2):
+            piece = (pieces[position - 1] if kept else "") + pieces[position]
+            tokens = self.count(piece)
+            if used + tokens > max_tokens:
+                break
+            kept += piece
+            used += tokens
+        if kept:
+            return kept
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens]).rstrip() + "…"
+
+    def _fields(self, text):
+        fields = []
+        for line in text.split("\n"):
+            if FIELD_LABEL.match(line) or not fields:
+                fields.append([line])
+            else:
+                fields[-1].append(line)
+        return ["\n".join(lines) for lines in fields]
+
+    def trim(self, text, max_tokens):
+        """
+        Cuts `text` to at most `max_tokens`, ending at the last whole sentence that fits.
+        Falls back to a token cut when even the first sentence is too long.
+
+        Tool results made of "Label: value" lines are trimmed inside their long text field
+        (Description, Content...), so the other fields, e.g. the Link line after the
+        description, and the line structure are kept.
+        """
+        if self.count(text) <= max_tokens:
+            return text
+        fields = self._fields(text)
+        if len(fields) > 1:
+            candidates = [i for i, field in enumerate(fields) if field.startswith(TRIM_FIELDS)] or range(len(fields))
+            target = max(candidates, key=lambda i: len(fields[i]))
+            label = FIELD_LABEL.match(fields[target])
+            label = label.group(0) if label else ""
+            fixed = self.count("\n".join(field for i, field in enumerate(fields) if i != target) + "\n" + label)
+            room = max_tokens - fixed
+            for _ in range(3):
+                if room < 1:
+                    break
+                fields[target] = label + self._trim_sentences(fields[target][len(label):], room)
+                trimmed = "\n".join(fields)
+                overflow = self.count(trimmed) - max_tokens
+                if overflow <= 0:
+                    return trimmed
+                # spajanje tokena na granicama moze da promeni broj; smanjuje se prostor i ponavlja
+                room -= overflow
+        return self._trim_sentences(text, max_tokens)
+
+    def assemble(self, items):
+        """
+        Returns (context, stats) for a tool result.
+
+        Args:
+            items (str | list): Tool output; a string, or a list of strings / (text, score) pairs.
+
+        Returns:
+            tuple: The packed context (blocks joined by blank lines) and a dict with 'tokens',
+                   'items', 'dropped', 'trimmed' and 'score_cutoff' (lowest included score or None).
+        """
+        if isinstance(items, str):
+            if not items.strip():
+                return items, {"tokens": 0, "items": 0, "dropped": 0, "trimmed": 0, "score_cutoff": None}
+            items = [block for block in BLOCK_SEPARATOR.split(items.strip()) if block.strip()]
+        items = [item if isinstance(item, tuple) else (item, None) for item in items]
+        # sortiranje je stabilno, pa stavke bez skora zadrzavaju redosled alata
+        ranked = sorted(items, key=lambda item: -item[1] if item[1] is not None else 0)
+
+        packed, used, trimmed, cutoff = [], 0, 0, None
+        separator = self.count("\n\n")
+        for text, score in ranked:
+            text = text.strip()
+            remaining = self.budget - used - (separator if packed else 0)
+            if remaining < self.min_item_tokens:
+                break
+            limit = min(self.max_item_tokens, remaining)
+            cut = self.trim(text, limit)
+            if cut != text:
+                trimmed += 1
+            packed.append(cut)
+            used += self.count(cut) + (separator if len(packed) > 1 else 0)
+            if score is not None:
+                cutoff = score if cutoff is None else min(cutoff, score)
+
+        stats = {"tokens": used, "items": len(packed), "dropped": len(ranked) - len(packed),
+                 "trimmed": trimmed, "score_cutoff": cutoff}
+        print(f"Context: {stats}")
+        return "\n\n".join(packed), stats
+
+
+@st.cache_resource
+def get_context_assembler():
+    return ContextAssembler()
@@ -0,0 +1,243 @@
+import json
+import os
+import re
+import threading
+import streamlit as st
+from klotbot_text import stem_terms
+
+# Namere (intent) i regex za izvlacenje slotova iz pitanja. Redosled je bitan,
+# prva namera koja se poklopi pobedjuje.
+INTENT_PATTERNS = [
+    ("stock", r"(?:imate|imamo|ima)\s+(?:li\s+)?(?:knjig\w*\s+)?(?P<title>.+?)\s+na\s+(?:stanju|lageru)"),
+    ("price", r"(?:\bcen[aeu]|košta|kosta)\s+(?:je\s+)?(?:za\s+)?(?:knjig\w*\s+)?(?P<title>.+?)[?.!]*$"),
+    ("pages", r"(?:koliko\s+)?(?:strana|stranica)\s+(?:ima\s+)?(?:knjig\w*\s+)?(?P<title>.+?)[?.!]*$"),
+    ("author_of", r"ko\s+je\s+(?:napisao|napisala|autor)\s+(?:knjig\w*\s+)?(?P<title>.+?)[?.!]*$"),
+    ("similar", r"(?:slične|slicne|slično|slicno)\s+(?:knjizi|knjigama|knjiga)?\s*(?P<title>.+?)[?.!]*$"),
+    ("author", r"(?:knjig\w*|dela|romane)\s+(?:od|autora|koje\s+je\s+napisao|koje\s+je\s+napisala|je\s+napisao|je\s+napisala)\s+(?P<author>.+?)[?.!]*$"),
+    ("genre", r"(?:knjig\w*|romane|naslove)\s+(?:iz\s+)?(?:žanra|zanra)\s+(?P<genre>.+?)[?.!]*$"),
+    ("title", r"(?:pronađi|pronadji|nađi|nadji|tražim|trazim|interesuje\s+me)\s+(?:knjig\w*\s+)?(?P<title>.+?)[?.!]*$"),
+]
+
+# Slotovi koji imaju podrazumevanu vrednost kada ih pitanje ne navodi
+DEFAULT_SLOTS = {"stock": {"min_qty": 0}}
+
+# Parametrizovani upiti za najcesce namere. Tekstualni slotovi su liste
+# korena reci, pa padezi ("anu karenjinu") i dalje nalaze naslov.
+SEED_TEMPLATES = {
+    "title|title": (
+        "MATCH (b:Book) WHERE ALL(w IN $title WHERE toLower(b.title) CONTAINS w) RETURN b"
+    ),
+    "price|title": (
+        "MATCH (b:Book) WHERE ALL(w IN $title WHERE toLower(b.title) CONTAINS w) AND b.quantity > 0 "
+        "RETURN b.title AS title, b.oldProductId AS oldProductId, b.category AS category, b.price AS price"
+    ),
+    "stock|min_qty,title": (
+        "MATCH (b:Book) WHERE ALL(w IN $title WHERE toLower(b.title) CONTAINS w) AND b.quantity > $min_qty "
+        "RETURN b.title AS title, b.quantity AS quantity, b.oldProductId AS oldProductId, b.category AS category"
+    ),
+    "author|author": (
+        "MATCH (b:Book)-[:WROTE]-(a:Author) WHERE ALL(w IN $author WHERE toLower(a.name) CONTAINS w) AND b.quantity > 0 "
+        "RETURN b.title AS title, b.oldProductId AS oldProductId, b.category AS category, a.name AS author"
+    ),
+    "similar|title": (
+        "MATCH (b:Book)-[:BELONGS_TO]->(g:Genre) WHERE ALL(w IN $title WHERE toLower(b.title) CONTAINS w) "
+        "WITH b, g MATCH (rec:Book)-[:BELONGS_TO]->(g) WHERE rec <> b AND rec.quantity > 0 "
+        "MATCH (rec)-[:WROTE]-(a:Author) "
+        "RETURN DISTINCT rec.title AS title, rec.oldProductId AS oldProductId, rec.category AS category, a.name AS author"
+    ),
+}
+
+# Recci koje ne nose naslov/autora; ne ulaze u slotove
+STOPWORDS = {
+    "a", "ali", "bi", "da", "do", "i", "ih", "ili", "iz", "je", "jos", "još", "k", "ka", "koja", "koje", "koji",
+    "li", "me", "mi", "na", "ne", "o", "od", "po", "pa", "sa", "se", "su", "te", "to", "u", "uz", "vi", "za",
+    "imate", "ima", "imamo", "stanju", "lageru", "knjiga", "knjigu", "knjige", "roman", "romane", "delo", "dela",
+}
+# Koreni koji znace da je pitanje o prodavnici (dostava, placanje...), a ne o knjizi
+SERVICE_STEMS = ("dostav", "isporu", "poštar", "postar", "adres", "porudž", "porudz", "plaćan", "placan",
+                 "kartic", "pouzeć", "pouzec", "račun", "racun", "reklamac", "povrać", "povrac", "prodavnic")
+# Najkraci koren koji se salje u CONTAINS; kraci termini pogadjaju skoro svaki naslov
+MIN_TERM_LENGTH = 4
+
+
+def slot_terms(text):
+    """
+    Splits a slot value into word stems, without stopwords and stems shorter than MIN_TERM_LENGTH.
+    """
+    words = [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+    return [term for term in stem_terms(" ".join(words)) if len(term) >= MIN_TERM_LENGTH or term.isdigit()]
+
+
+def weak_terms(terms):
+    """
+    True if slot terms are too weak for the template path: nothing left after filtering,
+    only numbers, or a shop-service word that means the question is not about a book.
+    """
+    if not any(not term.isdigit() for term in terms):
+        return True
+    return any(term.startswith(SERVICE_STEMS) for term in terms)
+
+
+def extract_slots(question):
+    """
+    Detects the intent of a question and extracts its entity slots.
+
+    Returns:
+        tuple: (intent, slots) where slots maps slot names to Cypher parameter values,
+               or (None, {}) when no known intent matches or the slot terms are weak,
+               in which case the question goes to the LLM Cypher generator.
+    """
+    text = question.strip()
+    quoted = re.search(r"['\"„“»«]([^'\"„“»«]+)['\"„“»«]", text)
+    qty = re.search(r"(\d+)\s*(?:komad|primer|kom\b)", text, re.IGNORECASE)
+    for intent, pattern in INTENT_PATTERNS:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if not match:
+            continue
+        slots = dict(DEFAULT_SLOTS.get(intent, {}))
+        for name, value in match.groupdict().items():
+            value = quoted.group(1) if quoted and name == "title" else value
+            terms = slot_terms(value)
+            if weak_terms(terms):
+                return None, {}
+            slots[name] = terms
+        if qty:
+            slots["min_qty"] = int(qty.group(1))
+        return intent, slots
+    return None, {}
+
+
+def parameterize_cypher(cypher_query):
+    """
+    Turns an LLM generated Cypher query into a parameterized template.
+
+    `toLower(x.prop) CONTAINS toLower('...')` predicates become `$title`, `$author`
+    or `$genre` term lists and `quantity > N` becomes `$min_qty`.
+
+    Returns:
+        tuple: (template, slot_names) or (None, None) if literals remain that cannot be parameterized.
+    """
+    labels = dict(re.findall(r"\((\w+):(\w+)", cypher_query))
+    slot_for_label = {"Book": "title", "Author": "author", "Genre": "genre"}
+    slot_names = set()
+
+    def replace_contains(match):
+        alias, prop = match.group(1), match.group(2)
+        slot = slot_for_label.get(labels.get(alias))
+        if slot is None:
+            return match.group(0)
+        slot_names.add(slot)
+        return f"ALL(w IN ${slot} WHERE toLower({alias}.{prop}) CONTAINS w)"
+
+    template = re.sub(r"toLower\((\w+)\.(\w+)\)\s+CONTAINS\s+toLower\('[^']*'\)", replace_contains, cypher_query)
+
+    def replace_qty(match):
+        if int(match.group(2)) == 0:
+            return match.group(0)
+        slot_names.add("min_qty")
+        return f"{match.group(1)}.quantity > $min_qty"
+
+    template = re.sub(r"(\w+)\.quantity\s*>\s*(\d+)", replace_qty, template)
+    if "'" in template or '"' in template:
+        return None, None
+    return template, slot_names
+
+
+class CypherTemplateCache:
+    """
+    Cache of parameterized Cypher statements keyed by intent and slot names.
+
+    Common intents are answered from the cache and run through driver parameters,
+    so no LLM call is needed and Neo4j can reuse cached query plans. Questions with
+    an unknown shape go to the LLM generator; its query is parameterized into a candidate
+    template, which is stored (and served for the same shape next time) only after the caller
+    has validated and successfully run the query and calls `confirm`.
+
+    Attributes:
+        path (str): JSON file used to persist learned templates (None keeps them in memory).
+        templates (dict): Mapping of shape key to parameterized Cypher.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else os.getenv("CYPHER_TEMPLATE_FILE", "cypher_templates.json")
+        self.templates = dict(SEED_TEMPLATES)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "learned": 0}
+        self.load()
+
+    @staticmethod
+    def shape_key(intent, slot_names):
+        return f"{intent}|{','.join(sorted(slot_names))}"
+
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as file:
+                    self.templates.update(json.load(file))
+            except (OSError, ValueError) as e:
+                print(f"Error loading Cypher templates: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        learned = {k: v for k, v in self.templates.items() if k not in SEED_TEMPLATES}
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(learned, file, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving Cypher templates: {e}")
+
+    def resolve(self, question, generate):
+        """
+        Returns the Cypher query and parameters for a question.
+
+        Args:
+            question (str): The user question.
+            generate (callable): LLM Cypher generator, called only for unknown shapes.
+
+        Returns:
+            tuple: (cypher_query, params, candidate). params is empty for LLM generated queries;
+                   candidate is (shape_key, template) to pass to `confirm` once the query worked,
+                   or None.
+        """
+        intent, slots = extract_slots(question)
+        key = self.shape_key(intent, slots) if intent else None
+        with self._lock:
+            template = self.templates.get(key) if key else None
+            self._stats["hits" if template else "misses"] += 1
+        if template:
+            print(f"Cypher template hit: {key}")
+            return template, slots, None
+
+        cypher_query = generate(question)
+        candidate = None
+        if key:
+            template, slot_names = parameterize_cypher(cypher_query)
+            # cuvamo samo sablone koje mozemo popuniti iz samog pitanja
+            if template and slot_names == set(slots):
+                candidate = (key, template)
+        return cypher_query, {}, candidate
+
+    def confirm(self, key, template):
+        """
+        Stores a candidate template from `resolve` after its query passed validation and
+        returned results.
+        """
+        with self._lock:
+            if self.templates.get(key) == template:
+                return
+            self.templates[key] = template
+            self._stats["learned"] += 1
+            self.save()
+        print(f"Cypher template learned: {key}")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self.templates))
+
+
+@st.cache_resource
+def get_cypher_cache():
+    return CypherTemplateCache()
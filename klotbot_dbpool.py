@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+import pyodbc
+import streamlit as st
+
+# SQLSTATE klase koje znace da je konekcija neupotrebljiva
+BROKEN_SQLSTATES = ("08", "HYT")
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of pyodbc connections to one MSSQL database.
+
+    A thread checks out one connection; nested checkouts in the same thread get the same
+    connection back, so `with ConversationDatabase()` inside another block does not open a
+    second session. Connections idle for longer than `health_check_interval` are pinged with
+    SELECT 1 before reuse, connections idle for longer than `idle_timeout` or older than
+    `max_lifetime` are closed, and at most `max_size` connections exist at once; further
+    checkouts wait up to `checkout_timeout` seconds. Returned connections are rolled back so
+    the next user starts without an open transaction.
+
+    Attributes:
+        max_size (int): Maximum open connections (MSSQL_POOL_SIZE, default 10).
+        idle_timeout (float): Seconds an idle connection is kept (MSSQL_POOL_IDLE_TIMEOUT, default 300).
+
+    Example usage:
+    pool = ConnectionPool(lambda: pyodbc.connect(...), max_size=5)
+    conn = pool.acquire()
+    try:
+        conn.cursor().execute("SELECT 1")
+    finally:
+        pool.release(conn)
+    pool.metrics()  # {'checkouts': 1, 'waits': 0, 'created': 1, 'in_use': 0, 'idle': 1, ...}
+    """
+
+    def __init__(self, connect, max_size=None, idle_timeout=None, health_check_interval=30, max_lifetime=3600, checkout_timeout=10):
+        self.connect = connect
+        self.max_size = max_size if max_size is not None else int(os.getenv("MSSQL_POOL_SIZE", 10))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("MSSQL_POOL_IDLE_TIMEOUT", 300))
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self._idle = []  # (connection, created_at, returned_at), poslednji vraceni na kraju
+        self._created = {}  # id(connection) -> created_at, za sve otvorene konekcije
+        self._size = 0
+        self._local = threading.local()
+        self._condition = threading.Condition()
+        self._metrics = {"checkouts": 0, "reused": 0, "waits": 0, "wait_seconds": 0.0, "created": 0,
+                         "closed": 0, "health_check_failures": 0, "timeouts": 0}
+
+    def _close(self, conn):
+        # poziva se pod self._condition
+        self._created.pop(id(conn), None)
+        self._size -= 1
+        self._metrics["closed"] += 1
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    def _expire_idle(self, now):
+        # poziva se pod self._condition
+        keep = []
+        for conn, created_at, returned_at in self._idle:
+            if now - returned_at > self.idle_timeout or now - created_at > self.max_lifetime:
+                self._close(conn)
+            else:
+                keep.append((conn, created_at, returned_at))
+        self._idle = keep
+
+    def _healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def acquire(self):
+        """
+        Returns a connection for the calling thread. Raises TimeoutError if the pool stays full.
+        """
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        wait_start = time.monotonic()
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                self._expire_idle(now)
+                if self._idle:
+                    conn, created_at, returned_at = self._idle.pop()
+                    check = now - returned_at > self.health_check_interval
+                elif self._size < self.max_size:
+                    self._size += 1
+                    conn, check = None, False
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        raise TimeoutError(f"No MSSQL connection available within {self.checkout_timeout}s")
+                    if not waited:
+                        self._metrics["waits"] += 1
+                        waited = True
+                    self._condition.wait(remaining)
+                    continue
+
+            if conn is None:
+                try:
+                    conn = self.connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._created[id(conn)] = time.monotonic()
+                    self._metrics["created"] += 1
+            elif check and not self._healthy(conn):
+                with self._condition:
+                    self._metrics["health_check_failures"] += 1
+                    self._close(conn)
+                    self._condition.notify()
+                continue
+            else:
+                with self._condition:
+                    self._metrics["reused"] += 1
+
+            with self._condition:
+                self._metrics["checkouts"] += 1
+                if waited:
+                    self._metrics["wait_seconds"] += time.monotonic() - wait_start
+            self._local.held = conn
+            self._local.depth = 1
+            return conn
+
+    def release(self, conn, broken=False):
+        """
+        Returns the thread's connection to the pool (after the outermost checkout).
+
+        Args:
+            conn: The connection from `acquire`.
+            broken (bool): Close the connection instead of reusing it.
+        """
+        if getattr(self._local, "held", None) is conn and self._local.depth > 1:
+            self._local.depth -= 1
+            return
+        self._local.held = None
+        self._local.depth = 0
+        if not broken:
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                broken = True
+        with self._condition:
+            if broken or id(conn) not in self._created:
+                self._close(conn)
+            else:
+                self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+            self._condition.notify()
+
+    def metrics(self):
+        """
+        Returns checkout/wait counters, pool occupancy and connection ages in seconds.
+        """
+        with self._condition:
+            now = time.monotonic()
+            ages = [now - created_at for created_at in self._created.values()]
+            metrics = dict(self._metrics, size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle))
+        metrics["max_connection_age"] = max(ages) if ages else 0.0
+        metrics["avg_connection_age"] = sum(ages) / len(ages) if ages else 0.0
+        return metrics
+
+    def close(self):
+        with self._condition:
+            for conn, _, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+
+def is_broken(error):
+    """
+    True if a pyodbc error means the connection itself is unusable (network, login, timeout).
+    """
+    if isinstance(error, (pyodbc.InterfaceError, pyodbc.OperationalError)):
+        return True
+    sqlstate = error.args[0] if isinstance(error, pyodbc.Error) and error.args else ""
+    return isinstance(sqlstate, str) and sqlstate.startswith(BROKEN_SQLSTATES)
+
+
+@st.cache_resource
+def get_connection_pool(host, user, password, database):
+    def connect():
+        return pyodbc.connect(
+            driver='{ODBC Driver 18 for SQL Server}',
+            server=host,
+            database=database,
+            uid=user,
+            pwd=password,
+            TrustServerCertificate='yes'
+        )
+    return ConnectionPool(connect)
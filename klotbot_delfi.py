@@ -13,13 +13,18 @@ import soundfile as sf
 from openai import OpenAI
 from streamlit_mic_recorder import mic_recorder
 from myfunc.mojafunkcija import positive_login, initialize_session_state, check_openai_errors, read_txts, copy_to_clipboard
-from klotbot_delfi_funcs import HybridQueryProcessor, SelfQueryDelfi, graphp, pineg, order_search, API_search
-from klotbot_promptdb import ConversationDatabase, work_prompts
+from klotbot_delfi_funcs import HybridQueryProcessor, SelfQueryDelfi, graphp, pineg, order_search, API_search, multi_namespace_search
+from klotbot_context import get_context_assembler
+from klotbot_promptdb import ConversationDatabase, ensure_schema, work_prompts
+from klotbot_router import get_router
+from klotbot_speculative import get_speculative_retriever
+from klotbot_writebehind import get_conversation_writer
 from myfunc.pyui_javascript import chat_placeholder_color, st_fixed_container
 import json
 import asyncio
 import aiohttp
 mprompts = work_prompts()
+ensure_schema()
 
 default_values = {
     "prozor": st.query_params.get('prozor', "d"),
@@ -346,36 +351,41 @@ def get_structured_decision_from_model(user_query):
     return data_dict['tool'] if 'tool' in data_dict else list(data_dict.values())[0]
 
 
-def rag_tool_answer(prompt):
-    context = " "
-    st.session_state.rag_tool = get_structured_decision_from_model(prompt)
-
-    if  st.session_state.rag_tool == "Hybrid":
-        processor = HybridQueryProcessor()
-        context, scores = processor.process_query_results(prompt)
-
-    elif  st.session_state.rag_tool == "Opisi":
-        uvod = mprompts["rag_self_query"]
-        prompt = uvod + prompt
-        context = SelfQueryDelfi(prompt)
-
-    elif  st.session_state.rag_tool == "Korice":
-        uvod = mprompts["rag_self_query"]
-        prompt = uvod + prompt
-        context = SelfQueryDelfi(upit=prompt, namespace="korice")
-        
-    elif  st.session_state.rag_tool == "Graphp": 
-        context = graphp(prompt, False)
+# alati koje router moze da izabere; svaki prima pitanje i vraca kontekst
+RAG_TOOLS = {
+    "Hybrid": lambda prompt: HybridQueryProcessor().context_items(prompt),
+    "Opisi": lambda prompt: SelfQueryDelfi(prompt, instructions=mprompts["rag_self_query"]),
+    "Korice": lambda prompt: SelfQueryDelfi(upit=prompt, namespace="korice", instructions=mprompts["rag_self_query"]),
+    "Graphp": lambda prompt: graphp(prompt, False),
+    "Pineg": lambda prompt: pineg(prompt),
+    "CSV": lambda prompt: order_search(prompt),
+    "Stolag": lambda prompt: API_search(graphp(prompt, True)),
+}
 
-    elif st.session_state.rag_tool == "Pineg":
-        context = pineg(prompt)
+# MULTI_NAMESPACE_RETRIEVAL=1: pitanja o opisima i koricama pretrazuju oba namespace-a odjednom
+if os.getenv("MULTI_NAMESPACE_RETRIEVAL", "0") == "1":
+    RAG_TOOLS["Opisi"] = RAG_TOOLS["Korice"] = lambda prompt: multi_namespace_search(prompt, instructions=mprompts["rag_self_query"])
 
-    elif st.session_state.rag_tool == "CSV":
-        context = order_search(prompt)
 
-    elif st.session_state.rag_tool == "Stolag":
-        context = API_search(graphp(prompt, True) )
+def choose_rag_tool(prompt):
+    # lokalni router, LLM se poziva samo kada router nije dovoljno siguran
+    st.session_state.rag_route = get_router().route(prompt, fallback=get_structured_decision_from_model)
+    return st.session_state.rag_route["tool"]
 
+
+def rag_tool_answer(prompt):
+    if os.getenv("SPECULATIVE_RETRIEVAL", "0") == "1":
+        # najverovatniji alati se pokrecu paralelno sa odlukom rutera
+        st.session_state.rag_tool, context = get_speculative_retriever().run(prompt, choose_rag_tool, RAG_TOOLS)
+    else:
+        st.session_state.rag_tool = choose_rag_tool(prompt)
+        if st.session_state.rag_tool not in RAG_TOOLS:
+            return " "
+        context = RAG_TOOLS[st.session_state.rag_tool](prompt)
+    if context is None:
+        return " "
+    # rezultati se pakuju po skoru do budzeta tokena
+    context, st.session_state.context_stats = get_context_assembler().assemble(context)
     return context
 
 
@@ -412,13 +422,13 @@ def main():
     else:
         current_thread_id = st.session_state.thread_id
 
-        with ConversationDatabase() as db:
-            db.update_or_insert_sql_record(
-                st.session_state.app_name,
-                st.session_state.username,
-                current_thread_id,
-                st.session_state.messages[current_thread_id]
-            )
+        # upis ide u pozadini; rerun bez novih poruka ne stize do baze
+        get_conversation_writer().mark_dirty(
+            st.session_state.app_name,
+            st.session_state.username,
+            current_thread_id,
+            st.session_state.messages[current_thread_id]
+        )
 
         try:
             if "Thread_" in st.session_state.thread_id:
@@ -431,6 +441,8 @@ def main():
         # Check if there's an existing conversation in the session state
         if current_thread_id not in st.session_state.messages:
             # If not, initialize it with the conversation from the database or as an empty list
+            # nit se cita tek kada su svi zapoceti upisi zavrseni
+            get_conversation_writer().flush_now(timeout=5)
             with ConversationDatabase() as db:
                 st.session_state.messages[current_thread_id] = db.query_sql_record(st.session_state.app_name, st.session_state.username, current_thread_id) or []
         if current_thread_id in st.session_state.messages:
@@ -587,6 +599,10 @@ def main():
             copy_to_clipboard(full_response)
             # Append assistant's response to the conversation
             st.session_state.messages[current_thread_id].append({"role": "assistant", "content": full_response})
+            get_conversation_writer().mark_dirty(
+                st.session_state.app_name, st.session_state.username, current_thread_id,
+                st.session_state.messages[current_thread_id]
+            )
             st.session_state.filtered_messages = ""
             filtered_data = [entry for entry in st.session_state.messages[current_thread_id] if entry['role'] in ["user", 'assistant']]
             for item in filtered_data:  # lista za download conversation
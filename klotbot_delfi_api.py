@@ -0,0 +1,269 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+import aiohttp
+import streamlit as st
+
+DELFI_API_URL = "https://www.delfi.rs/api/products"
+
+
+class ProductInfo(NamedTuple):
+    """
+    Product data returned by the Delfi products API for one product_id.
+    """
+    product_id: str
+    found: bool
+    cena: Optional[str] = None
+    lager: Optional[int] = None
+    url: Optional[str] = None
+    na_stanju: Optional[str] = None
+    error: Optional[str] = None  # popunjeno kada API nije odgovorio (timeout, mreza, 5xx); found je tada False
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _describe(error):
+    # repr greske aiohttp sadrzi ceo URL zahteva, a time i token=DELFI_API_KEY; zato samo status ili tip
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"status {error.status}"
+    return type(error).__name__
+
+
+class DelfiProductClient:
+    """
+    Concurrent client for the Delfi products API.
+
+    Requests run on a dedicated event loop thread that owns one aiohttp session, so the
+    connection pool (and TLS sessions) are reused across calls and Streamlit reruns.
+    Concurrency is bounded by `max_concurrency`; each request has a timeout and is retried
+    with jittered exponential backoff. Responses are parsed incrementally and parsing stops
+    as soon as the <product> element is complete.
+
+    Example usage:
+    client = DelfiProductClient(max_concurrency=10, timeout=5)
+    products = client.get_products([77626, 69471, 150516])  # [ProductInfo(...), ...] in input order
+    """
+
+    def __init__(self, token=None, url=DELFI_API_URL, max_concurrency=10, pool_size=20, timeout=5.0, retries=2, backoff=0.2):
+        self.token = token if token is not None else os.getenv("DELFI_API_KEY")
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._semaphore = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="delfi-api", daemon=True)
+        self._thread.start()
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _parse(self, response, product_id):
+        parser = ET.XMLPullParser(events=("end",))
+        product = ProductInfo(product_id=str(product_id), found=False)
+        async for chunk in response.content.iter_chunked(4096):
+            if product.found:
+                # ostatak tela se samo cita da bi konekcija ostala u pool-u
+                continue
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                if element.tag == "product":
+                    product = ProductInfo(
+                        product_id=str(product_id),
+                        found=True,
+                        cena=element.findtext("cena"),
+                        lager=_to_int(element.findtext("lager")),
+                        url=element.findtext("url"),
+                        na_stanju=element.findtext("na_stanju"),
+                    )
+                    break
+        if not product.found:
+            # close() prijavljuje skraceno ili nezatvoreno telo kao ParseError, a ne kao "nije pronadjen"
+            parser.close()
+        return product
+
+    async def fetch_product(self, product_id):
+        """
+        Fetches one product; returns ProductInfo(found=False) when it does not exist and
+        ProductInfo(found=False, error=...) when the API could not be read.
+        """
+        session = await self._get_session()
+        params = {"token": self.token, "product_id": product_id}
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    async with session.get(self.url, params=params) as response:
+                        if response.status >= 500:
+                            raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+                        if response.status != 200:
+                            print(f"Delfi API status {response.status} for product_id {product_id}")
+                            error = None if response.status == 404 else f"status {response.status}"
+                            return ProductInfo(product_id=str(product_id), found=False, error=error)
+                        return await self._parse(response, product_id)
+            except ET.ParseError as e:
+                print(f"Error parsing XML for product_id {product_id}: {e}")
+                return ProductInfo(product_id=str(product_id), found=False, error=f"parse: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    print(f"Delfi API request failed for product_id {product_id}: {_describe(e)}")
+                    return ProductInfo(product_id=str(product_id), found=False, error=_describe(e))
+                await asyncio.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    async def fetch_many(self, product_ids):
+        return list(await asyncio.gather(*(self.fetch_product(product_id) for product_id in product_ids)))
+
+    def get_products(self, product_ids):
+        """
+        Synchronous entry point: fetches all products concurrently and returns them in input order.
+        """
+        if not product_ids:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self.fetch_many(list(product_ids)), self._loop)
+        return future.result()
+
+    def close(self):
+        async def _close():
+            if self._session is not None:
+                await self._session.close()
+        asyncio.run_coroutine_threadsafe(_close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+@st.cache_resource
+def get_product_client():
+    # jedan event loop i jedna aiohttp sesija po procesu, deli se izmedju svih sesija
+    return DelfiProductClient(max_concurrency=10, timeout=5.0)
+
+
+PRICE_FIELDS = ("cena", "url")
+STOCK_FIELDS = ("lager", "na_stanju")
+FIELD_GROUPS = {"price": PRICE_FIELDS, "stock": STOCK_FIELDS}
+
+
+class ProductCache:
+    """
+    Product cache in front of DelfiProductClient with separate TTLs for price and stock.
+
+    Fresh entries are served directly. Entries past their TTL but younger than the stale bound
+    (`max_stale` for price, the much shorter `stock_max_stale` for stock) are served immediately and refreshed in the background (stale-while-revalidate); older
+    or unknown ids are fetched synchronously in one concurrent batch. Memory is capped at
+    `maxsize` entries with LRU eviction.
+
+    Each entry keeps a fetch time per field group (price, stock), and freshness is checked only
+    for the groups the caller asks for. Failed fetches (ProductInfo.error) are never cached; a
+    stale entry stays in place until a refresh succeeds.
+
+    Example usage:
+    cache = ProductCache(DelfiProductClient(), price_ttl=3600, stock_ttl=300)
+    products = cache.get_products([77626, 69471], fields=("cena", "lager"))
+    cache.invalidate(77626)
+    """
+
+    def __init__(self, client, price_ttl=3600, stock_ttl=300, max_stale=86400, stock_max_stale=600, maxsize=10000):
+        self.client = client
+        self.price_ttl = price_ttl
+        self.stock_ttl = stock_ttl
+        self.max_stale = max_stale
+        self.maxsize = maxsize
+        self.stock_max_stale = stock_max_stale
+        self.ttls = {"price": price_ttl, "stock": stock_ttl}
+        # stanje na lageru se ne prikazuje staro vise od nekoliko minuta, ni kada API ne radi
+        self.max_stales = {"price": max_stale, "stock": stock_max_stale}
+        self._data = OrderedDict()  # product_id -> ({grupa: vreme preuzimanja}, ProductInfo)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "evictions": 0}
+
+    @staticmethod
+    def _groups(fields):
+        groups = [group for group, group_fields in FIELD_GROUPS.items() if any(field in group_fields for field in fields)]
+        return groups or list(FIELD_GROUPS)
+
+    def _store(self, products):
+        now = time.monotonic()
+        with self._lock:
+            for product in products:
+                if product.error is not None:
+                    # neuspeo poziv se ne kesira; postojeci (zastareli) unos ostaje
+                    continue
+                # API vraca sva polja odjednom, pa se osvezavaju sve grupe
+                self._data[product.product_id] = ({group: now for group in FIELD_GROUPS}, product)
+                self._data.move_to_end(product.product_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _refresh(self, product_ids):
+        async def refresh():
+            try:
+                self._store(await self.client.fetch_many(product_ids))
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(product_ids)
+
+        asyncio.run_coroutine_threadsafe(refresh(), self.client._loop)
+
+    def get_products(self, product_ids, fields=PRICE_FIELDS + STOCK_FIELDS):
+        """
+        Returns ProductInfo records in input order, using cached values where allowed.
+
+        Args:
+            product_ids (list): Product ids to look up.
+            fields (tuple): Fields the caller needs; decides which field groups must be fresh.
+        """
+        groups = self._groups(fields)
+        now = time.monotonic()
+        found, missing, stale = {}, [], []
+        with self._lock:
+            for product_id in dict.fromkeys(str(product_id) for product_id in product_ids):
+                entry = self._data.get(product_id)
+                ages = {group: now - entry[0][group] for group in groups} if entry else None
+                if entry is not None and all(ages[group] < self.ttls[group] for group in groups):
+                    found[product_id] = entry[1]
+                    self._data.move_to_end(product_id)
+                    self._stats["hits"] += 1
+                elif entry is not None and all(ages[group] < self.max_stales[group] for group in groups):
+                    found[product_id] = entry[1]
+                    self._stats["stale_hits"] += 1
+                    if product_id not in self._refreshing:
+                        self._refreshing.add(product_id)
+                        stale.append(product_id)
+                else:
+                    missing.append(product_id)
+                    self._stats["misses"] += 1
+            if stale:
+                self._stats["refreshes"] += 1
+
+        if stale:
+            self._refresh(stale)
+        if missing:
+            fetched = self.client.get_products(missing)
+            self._store(fetched)
+            # neuspeli poziv se vraca pozivaocu (found=False, error), ali se ne pamti
+            found.update((product.product_id, product) for product in fetched)
+        return [found[str(product_id)] for product_id in product_ids]
+
+    def invalidate(self, product_id):
+        with self._lock:
+            self._data.pop(str(product_id), None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._data))
@@ -1,20 +1,21 @@
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai.chat_models import ChatOpenAI
-from langchain.chains.query_constructor.base import AttributeInfo
-from langchain.retrievers.self_query.base import SelfQueryRetriever
-from langchain_community.vectorstores import Pinecone as LangPine
 import re
-import csv
 import os
+import numpy as np
 import streamlit as st
 import neo4j
 from openai import OpenAI
-from pinecone import Pinecone
-from pinecone_text.sparse import BM25Encoder
 from typing import List, Dict
-from time import sleep
-import requests
-import xml.etree.ElementTree as ET
+from klotbot_ann import SearchIndex, get_local_index
+from klotbot_bm25 import get_sparse_encoder
+from klotbot_catalog import CatalogMirror
+from klotbot_cypher import get_cypher_cache
+from klotbot_delfi_api import ProductCache, get_product_client
+from klotbot_embeddings import get_embedding_service
+from klotbot_fusion import FusionRetriever
+from klotbot_orders import OrderIndex
+from klotbot_pinecone import DELFI_HOST, NEO_POSITIVE_HOST, get_pinecone_registry
+from klotbot_selfquery import get_self_query_registry, run_self_query, translate_self_query
+from klotbot_neo4j import BookCache, fetch_books, fulltext_available, rewrite_contains_to_fulltext, run_budgeted_query
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 @st.cache_resource
@@ -22,60 +23,53 @@ def connect_to_neo4j():
     return neo4j.GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASS")))
 
 @st.cache_resource
-def connect_to_pinecone():
-    pinecone_api_key = os.getenv('PINECONE_API_KEY')
-    pinecone_host = "https://delfi-a9w1e6k.svc.aped-4627-b74a.pinecone.io"
-    pc = Pinecone(api_key=pinecone_api_key, host=pinecone_host)
-    return pc.Index(host=pinecone_host)
+def get_delfi_client():
+    # cena se kesira duze od stanja na lageru, zastarele vrednosti se osvezavaju u pozadini
+    return ProductCache(
+        get_product_client(),
+        price_ttl=int(os.getenv("DELFI_PRICE_TTL", 3600)),
+        stock_ttl=int(os.getenv("DELFI_STOCK_TTL", 300)),
+        stock_max_stale=int(os.getenv("DELFI_STOCK_MAX_STALE", 600)),
+    )
+
+@st.cache_resource
+def get_order_index():
+    # indeks se obnavlja samo kada se orders.csv promeni
+    return OrderIndex('orders.csv')
+
+@st.cache_resource
+def get_book_cache():
+    return BookCache(maxsize=2048, ttl=300)
+
+@st.cache_resource
+def get_catalog():
+    return CatalogMirror()
+
+def local_catalog():
+    # lokalna memory-mapped kopija kataloga, osvezava se sa `python klotbot_catalog.py`
+    catalog = get_catalog()
+    catalog.reload_if_changed()
+    return catalog
+
+@st.cache_resource
+def neo4j_fulltext_ready():
+    # proverava se jednom po procesu; indeksi se kreiraju sa `python klotbot_neo4j.py`
+    return fulltext_available(connect_to_neo4j())
+
+def connect_to_pinecone(namespace='opisi'):
+    # VECTOR_SEARCH_MODE bira lokalni ANN indeks, Pinecone ili lokalni sa Pinecone rezervom
+    return SearchIndex(lambda: get_pinecone_registry().get(DELFI_HOST, namespace), get_local_index())
+
+@st.cache_resource
+def get_fusion_retriever():
+    return FusionRetriever(index_for=connect_to_pinecone, embed=get_embedding_service().embed)
 
 def graphp(pitanje, usingAPI):
     driver = connect_to_neo4j()
     namespace = 'opisi'
-    def run_cypher_query(driver, query):
-        with driver.session() as session:
-            results = session.run(query)
-            cleaned_results = []
-            max_characters=100000
-            total_characters = 0
-            max_record_length = 0
-            min_record_length = float('inf')
-            
-            for record in results:
-                cleaned_record = {}
-                for key, value in record.items():
-                    if isinstance(value, neo4j.graph.Node):
-                        # Ako je vrednost Node objekat, pristupamo properties atributima
-                        properties = {k: v for k, v in value._properties.items()}
-                    else:
-                        # Ako je vrednost obična vrednost, samo je dodamo
-                        properties = {key: value}
-                    
-                    for prop_key, prop_value in properties.items():
-                        # Uklanjamo prefiks 'b.' ako postoji
-                        new_key = prop_key.split('.')[-1]
-                        cleaned_record[new_key] = prop_value
-                
-                record_length = sum(len(str(value)) for value in cleaned_record.values())
-                if total_characters + record_length > max_characters:
-                    break  # Prekida se ako dodavanje ovog zapisa prelazi maksimalan broj karaktera
-
-                cleaned_results.append(cleaned_record)
-                record_length = sum(len(str(value)) for value in cleaned_record.values())
-                total_characters += record_length
-                if record_length > max_record_length:
-                    max_record_length = record_length
-                if record_length < min_record_length:
-                    min_record_length = record_length
-        
-        number_of_records = len(cleaned_results)
-        # average_characters_per_record = total_characters / number_of_records if number_of_records > 0 else 0
-
-        print(f"Number of records: {number_of_records}")
-        print(f"Total number of characters: {total_characters}")
-        # print(f"Average characters per record: {average_characters_per_record}")
-        # print(f"Longest record length: {max_record_length}")
-        # print(f"Shortest record length: {min_record_length}")
-
+    def run_cypher_query(driver, query, params=None):
+        cleaned_results, stats = run_budgeted_query(driver, query, params, max_characters=100000)
+        print(f"Cypher stats: {stats}")
         return cleaned_results
         
     def generate_cypher_query(question):
@@ -140,9 +134,15 @@ def graphp(pitanje, usingAPI):
     def create_product_links(products):
         static_url = 'https://delfi.rs/'
         updated_products = []
+        catalog = local_catalog()
         
         for product in products:
-            if 'oldProductId' in product and 'category' in product:
+            if 'oldProductId' in product and 'category' not in product:
+                # kategorija iz lokalne kopije kataloga umesto novog upita
+                row = catalog.get_by_old_product_id(product['oldProductId'])
+                if row and row['category']:
+                    product['category'] = row['category']
+            if 'oldProductId' in product and product.get('category'):
                 category = product['category'].lower().replace(' ', '_')
                 product['link'] = static_url + product['category'].lower() + '/' + str(product.pop('oldProductId'))
             updated_products.append(product)
@@ -206,6 +206,9 @@ def graphp(pitanje, usingAPI):
                 output += f"Description: {data['description']}\n"
             if 'link' in data:
                 output += f"Link: {data['link']}\n"
+            # prazan red odvaja knjige, ContextAssembler ih tako deli
+            output += "\n"
+        return output
 
     def is_valid_cypher(cypher_query):
         # Provera validnosti Cypher upita (osnovna provera)
@@ -231,12 +234,18 @@ def graphp(pitanje, usingAPI):
         )
         return response.choices[0].message.content.strip()
 
-    cypher_query = generate_cypher_query(pitanje)
-    print(f"Generated Cypher Query: {cypher_query}")
+    # parametrizovani sablon iz kesa, LLM samo za nepoznate oblike pitanja
+    cypher_query, cypher_params, candidate = get_cypher_cache().resolve(pitanje, generate_cypher_query)
+    if neo4j_fulltext_ready():
+        cypher_query, cypher_params = rewrite_contains_to_fulltext(cypher_query, cypher_params)
+    print(f"Generated Cypher Query: {cypher_query} {cypher_params}")
     
     if is_valid_cypher(cypher_query):
         try:
-            cleaned_data = run_cypher_query(driver, cypher_query)
+            cleaned_data = run_cypher_query(driver, cypher_query, cypher_params)
+            # LLM upit postaje sablon tek kada je prosao proveru i vratio rezultate
+            if candidate and cleaned_data:
+                get_cypher_cache().confirm(*candidate)
             book_data = create_product_links(cleaned_data)
 
             # print(f"Book Data: {book_data}")
@@ -272,33 +281,8 @@ def pineg(pitanje):
     namespace = 'opisi'
     index = connect_to_pinecone()
     driver = connect_to_neo4j()
-    def run_cypher_query(id):
-        query = f"MATCH (b:Book) WHERE b.id = '{id}' RETURN b"
-        with driver.session() as session:
-            result = session.run(query)
-            book_data = []
-            for record in result:
-                book_node = record['b']
-                book_data.append({
-                    'id': book_node['id'],
-                    'oldProductId': book_node['oldProductId'],
-                    'title': book_node['title'],
-                    'category': book_node['category'],
-                    'price': book_node['price'],
-                    'quantity': book_node['quantity'],
-                    'pages': book_node['pages'],
-                    'eBook': book_node['eBook']
-                })
-            return book_data
-
     def get_embedding(text, model="text-embedding-3-large"):
-        response = client.embeddings.create(
-            input=[text],
-            model=model
-        ).data[0].embedding
-        # print(f"Embedding Response: {response}")
-        
-        return response
+        return get_embedding_service().embed(text, model=model)
 
     def dense_query(query, top_k=5, filter=None, namespace=namespace):
         # Get embedding for the query
@@ -307,7 +291,7 @@ def pineg(pitanje):
 
         query_params = {
             'top_k': top_k,
-            'vector': dense,
+            'vector': dense.tolist(),
             'include_metadata': True,
             'namespace': namespace
         }
@@ -342,7 +326,7 @@ def pineg(pitanje):
         updated_products = []
         
         for product in products:
-            if 'oldProductId' in product and 'category' in product:
+            if 'oldProductId' in product and product.get('category'):
                 category = product['category'].lower().replace(' ', '_')
                 product['link'] = static_url + product['category'].lower() + '/' + str(product.pop('oldProductId'))
             updated_products.append(product)
@@ -367,65 +351,45 @@ def pineg(pitanje):
             output += f"Pages: {data['pages']}\n"
             output += f"eBook: {data['eBook']}\n"
             output += f"Description: {data['description']}\n"
-            output += f"Link: {data['link']}\n"
+            output += f"Link: {data.get('link', '')}\n\n"
         return output
 
     search_results = search_pinecone(pitanje)
 
-    combined_results = []
+    # prvo lokalna kopija kataloga, pa jedan UNWIND upit za ostale pogotke;
+    # kopija starija od CATALOG_MAX_AGE se preskace jer cena i stanje vise nisu pouzdani
+    ids = [result['id'] for result in search_results]
+    catalog = local_catalog()
+    books = {book['id']: book for book in catalog.get_many(ids)} if catalog.is_fresh() else {}
+    missing = [book_id for book_id in ids if book_id not in books]
+    if missing:
+        books.update({book['id']: book for book in fetch_books(driver, missing, cache=get_book_cache())})
 
+    combined_data = []
     for result in search_results:
-        
-        try:
-            data = run_cypher_query(result['id'])
-        except:
-            sleep(0.2)
-            data = run_cypher_query(result['id'])
-        additional_data = create_product_links(data)
+        if result['id'] not in books:
+            continue
+        additional_data = create_product_links([books[result['id']]])
         print(f"Additional Data: {additional_data}")
         
         # Korak 3: Kombinovanje podataka
-        combined_data = combine_data(additional_data, result['text'])
-        
-        combined_results.append(combined_data)
-
-    # return combined_results
-    # driver = connect_to_neo4j(uri, user, password)
-
-    # query = input("Enter your search content: ")
-
-    # results = search_pinecone(query)
-    # print(f"The type of the variable 'query' is: {type(results)}")
-    # ids, descriptions = zip(*results)
+        combined_data.extend(combine_data(additional_data, result['text']))
 
-    # if not ids:
-    #     print("No matching books found.")
-    #     return
-
-    # ids_str = ', '.join([f"'{id}'" for id in ids])
-    # cypher_query = f"MATCH (b:Book) WHERE b.id IN [{ids_str}] RETURN b"
-    # book_data = run_cypher_query(driver, cypher_query)
-
-    # combined_data = combine_data(book_data, descriptions)
     return display_results(combined_data)
 
 
 
 def order_search(id_porudzbine):
-    match = re.search(r'\d{5,}', id_porudzbine)
-    if not match:
+    order_numbers = [int(number) for number in re.findall(r'\d{5,}', id_porudzbine)]
+    if not order_numbers:
         return "No integer found in the prompt."
-    
-    order_number = int(match.group())
 
     try:
-        with open('orders.csv', mode='r', encoding='utf-8-sig') as file:
-            csv_reader = csv.reader(file)
-            next(csv_reader)
-            for row in csv_reader:
-                if int(row[0]) == order_number:
-                    return ", ".join(row)
-        return f"Order number {order_number} not found in the CSV file."
+        rows = get_order_index().lookup_many(order_numbers)
+        return "\n".join(
+            row if row is not None else f"Order number {number} not found in the CSV file."
+            for number, row in rows.items()
+        )
     except FileNotFoundError:
         return "The file 'orders.csv' does not exist."
     except Exception as e:
@@ -433,71 +397,63 @@ def order_search(id_porudzbine):
     
 
 def API_search(matching_sec_ids):
-    # Function to call the API for a specific product_id
-    def get_product_info(token, product_id):
-        url = "https://www.delfi.rs/api/products"  # Replace with your actual API endpoint
-        params = {
-            "token": token,
-            "product_id": product_id
-        }
-        response = requests.get(url, params=params)
-        print(f"API response for product_id {product_id}: {response.content}")  # Debugging line
-        return response.content
-
-    # Function to parse the XML response and extract required fields
-    def parse_product_info(xml_data):
-        product_info = {}
-        try:
-            root = ET.fromstring(xml_data)
-            product_node = root.find(".//product")
-            if product_node is not None:
-                cena = product_node.findtext('cena')
-                lager = product_node.findtext('lager')
-                url = product_node.findtext('url')
-                
-                if lager and int(lager) > 2:
-                    product_info = {
-                        'cena': cena,
-                        'lager': lager,
-                        'url': url
-                    }
-                else:
-                    print(f"Skipping product with lager {lager}")  # Debugging line
-            else:
-                print("Product node not found in XML data")  # Debugging line
-        except ET.ParseError as e:
-            print(f"Error parsing XML: {e}")  # Debugging line
-        return product_info
-
-    # Main function to get info for a list of product IDs
-    def get_multiple_products_info(token, product_ids):
-        products_info = []
-        for product_id in product_ids:
-            xml_data = get_product_info(token, product_id)
-            print(f"XML data for product_id {product_id}: {xml_data}")  # Debugging line
-            product_info = parse_product_info(xml_data)
-            if product_info:  # Only add if product info is found and lager > 2
-                products_info.append(product_info)
-        return products_info
-
-    # Replace with your actual token and product IDs
-    token = os.getenv("DELFI_API_KEY")
-    product_ids = matching_sec_ids
-
-    # Get the info for multiple products
+    # svi proizvodi se traze paralelno, kroz deljeni pool konekcija
     try:
-        products_info = get_multiple_products_info(token, product_ids)
-    except:
-        products_info = "No products found for the given IDs."
+        products = get_delfi_client().get_products(matching_sec_ids or [], fields=('cena', 'lager', 'url'))
+        # Only add if product info is found and lager > 2
+        products_info = [
+            {'cena': product.cena, 'lager': str(product.lager), 'url': product.url}
+            for product in products
+            if product.found and product.lager is not None and product.lager > 2
+        ]
+        # neuspeli pozivi se prijavljuju posebno, da ne bi izgledali kao rasprodati proizvodi
+        unavailable = [product.product_id for product in products if product.error is not None]
+    except Exception as e:
+        print(f"Error calling Delfi API: {e}")
+        products_info = ["No products found for the given IDs."]
+        unavailable = []
     print(f"Products Info: {products_info}")
     output = "Data returned from API for each searched id: \n"
     for info in products_info:
         output += str(info) + "\n"
+    if unavailable:
+        output += f"Product data temporarily unavailable for ids: {', '.join(unavailable)}\n"
     
     return output
 
 
-def SelfQueryDelfi(upit, api_key=None, environment=None, index_name='delfi', namespace='opisi', openai_api_key=None, host=None):
+def multi_namespace_search(pitanje, top_k=5, index_name='delfi', instructions=""):
+    # opisi i korice se pretrazuju paralelno i spajaju po id-u knjige (RRF)
+    try:
+        # autor, zanr, eBook... iz self-query prevoda vaze kao Pinecone filter u oba namespace-a
+        retriever = get_self_query_registry().get(index_name, 'opisi')
+        query, search_kwargs = translate_self_query(retriever, pitanje, instructions)
+        result = ""
+        books = get_fusion_retriever().search(
+            query.strip() or pitanje, top_k=search_kwargs.get("k") or top_k, filter=search_kwargs.get("filter")
+        )
+        for book in books:
+            metadata = book["metadata"]
+            result += (
+                f"Sec_id: {str(metadata.get('sec_id', ''))}\n"
+                f"Title: {str(metadata.get('title', ''))}\n"
+                f"Authors: {', '.join(map(str, metadata.get('authors') or []))}\n"
+                f"Genres: {', '.join(map(str, metadata.get('genres') or []))}\n"
+                f"URL: https://delfi.rs/{str(metadata.get('category', ''))}/{str(metadata.get('sec_id', ''))}\n"
+                f"ID: {book['id']}\n"
+            )
+            for namespace, match in book["matches"].items():
+                content = (match.get("metadata") or {}).get("text" if namespace == "opisi" else "description", "")
+                result += f"Content ({namespace}): {str(content)}\n"
+            result += "\n"
+        print(result)
+        return result.strip()
+    except Exception as e:
+        print(e)
+        return str(e)
+
+
+def SelfQueryDelfi(upit, api_key=None, environment=None, index_name='delfi', namespace='opisi', openai_api_key=None, host=None, instructions=""):
     """
     Executes a query against a Pinecone vector database using specified parameters or environment variables. 
     The function initializes the Pinecone and OpenAI services, sets up the vector store and metadata, 
@@ -512,6 +468,7 @@ def SelfQueryDelfi(upit, api_key=None, environment=None, index_name='delfi', nam
     index_name (str, optional): Name of the Pinecone index to use. Defaults to 'positive'.
     namespace (str, optional): Namespace for Pinecone index. Defaults to NAMESPACE from environment variables.
     openai_api_key (str, optional): OpenAI API key. Defaults to OPENAI_API_KEY from environment variables.
+    instructions (str, optional): Prefix for the query constructor; kept out of the translation cache key.
 
     Returns:
     str: A string containing the concatenated results from the query, with each document's metadata and content.
@@ -530,43 +487,12 @@ def SelfQueryDelfi(upit, api_key=None, environment=None, index_name='delfi', nam
     openai_api_key = openai_api_key if openai_api_key is not None else os.getenv("OPENAI_API_KEY")
     host = host if host is not None else os.getenv("PINECONE_HOST")
    
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-
-    # prilagoditi stvanim potrebama metadata
-    metadata_field_info = [
-        AttributeInfo(name="authors", description="The author(s) of the document", type="string"),
-        AttributeInfo(name="category", description="The category of the document", type="string"),
-        AttributeInfo(name="chunk", description="The chunk number of the document", type="integer"),
-        AttributeInfo(name="date", description="The date of the document", type="string"),
-        AttributeInfo(name="eBook", description="Whether the document is an eBook", type="boolean"),
-        AttributeInfo(name="genres", description="The genres of the document", type="string"),
-        AttributeInfo(name="id", description="The unique ID of the document", type="string"),
-        AttributeInfo(name="text", description="The main content of the document", type="string"),
-        AttributeInfo(name="title", description="The title of the document", type="string"),
-        AttributeInfo(name="sec_id", description="The ID for the url generation", type="string"),
-    ]
-
-    # Define document content description
-    document_content_description = "Content of the document"
-
-    # Prilagoditi stvanom nazivu namespace-a
-    text_key = "text" if namespace == "opisi" else "description"
-    vectorstore = LangPine.from_existing_index(
-        index_name=index_name, embedding=embeddings, text_key=text_key, namespace=namespace)
-
-    # Initialize OpenAI embeddings and LLM
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.0)
-    retriever = SelfQueryRetriever.from_llm(
-        llm,
-        vectorstore,
-        document_content_description,
-        metadata_field_info,
-        enable_limit=True,
-        verbose=True,
-    )
+    # retriever se pravi jednom po namespace-u i deli izmedju sesija
+    retriever = get_self_query_registry().get(index_name, namespace)
     try:
         result = ""
-        doc_result = retriever.get_relevant_documents(upit)
+        # strukturirani upit (filter po autorima, zanrovima...) se uzima iz kesa kada postoji
+        doc_result = run_self_query(retriever, upit, instructions)
         for doc in doc_result:
             metadata = doc.metadata
             result += (
@@ -643,46 +569,48 @@ class HybridQueryProcessor:
         self.namespace = kwargs.get('namespace', os.getenv("NAMESPACE"))  
         self.top_k = kwargs.get('top_k', 6)  # Default top_k is 6
         self.index = None
-        self.host = "https://neo-positive-a9w1e6k.svc.apw5-4e34-81fa.pinecone.io"
+        self.host = NEO_POSITIVE_HOST
         self.check_namespace = True if self.namespace in ["brosureiuputstva", "servis"] else False
         self.init_pinecone()
 
     def init_pinecone(self):
         """
-        Initializes the Pinecone connection and index.
+        Takes the shared index handle from the process-wide registry.
         """
-        pinecone=Pinecone(api_key=self.api_key, host=self.host)
-        self.index = pinecone.Index(host=self.host)
+        self.index = get_pinecone_registry().get(self.host, self.namespace)
 
     def hybrid_score_norm(self, dense, sparse):
         """
         Normalizes the scores from dense and sparse vectors using the alpha value.
 
         Args:
-            dense (list): The dense vector scores.
+            dense (np.ndarray): The dense vector scores (float32).
             sparse (dict): The sparse vector scores.
 
         Returns:
-            tuple: Normalized dense and sparse vector scores.
+            tuple: Normalized dense and sparse vector scores as float32 arrays.
         """
-        return ([v * self.alpha for v in dense], 
-                {"indices": sparse["indices"], 
-                 "values": [v * (1 - self.alpha) for v in sparse["values"]]})
+        alpha = np.float32(self.alpha)
+        return (dense * alpha,
+                {"indices": sparse["indices"],
+                 "values": np.asarray(sparse["values"], dtype=np.float32) * (np.float32(1) - alpha)})
     
     def hybrid_query(self, upit, top_k=None, filter=None, namespace=None):
         # Get embedding and unpack results
         dense = self.get_embedding(text=upit)
 
         # Use those results in another function call
+        # BM25 parametri su fitovani na opisima iz kataloga i ucitavaju se jednom po procesu
         hdense, hsparse = self.hybrid_score_norm(
-            sparse=BM25Encoder().fit([upit]).encode_queries(upit),
+            sparse=get_sparse_encoder().encode_query(upit),
             dense=dense
         )
 
+        # Pinecone klijent prima liste, pa se nizovi konvertuju samo ovde
         query_params = {
             'top_k': top_k or self.top_k,
-            'vector': hdense,
-            'sparse_vector': hsparse,
+            'vector': hdense.tolist(),
+            'sparse_vector': {"indices": hsparse["indices"], "values": hsparse["values"].tolist()},
             'include_metadata': True,
             'namespace': namespace or self.namespace
         }
@@ -735,7 +663,20 @@ class HybridQueryProcessor:
             return uk_teme, score_list
         else:
             return tematika, []
-        
+
+    def context_items(self, upit):
+        """
+        Returns (text, score) pairs above the score threshold, for ContextAssembler.
+        """
+        items = []
+        for item in self.hybrid_query(upit):
+            if item["score"] > self.score:
+                text = item["page_content"]
+                if self.check_namespace:
+                    text += f"\nFilename: {item['filename']}\nURL: {item['url']}"
+                items.append((text, item["score"]))
+        return items
+
     def get_embedding(self, text, model="text-embedding-3-large"):
 
         """
@@ -746,12 +687,8 @@ class HybridQueryProcessor:
             model (str): The model to be used for embedding. Default is "text-embedding-3-large".
 
         Returns:
-            list: The embedding vector of the given text.
-            int: The number of prompt tokens used.
+            np.ndarray: The float32 embedding of the given text, served from the shared
+                  embedding cache when the text was embedded before.
         """
-        
-        text = text.replace("\n", " ")
-        result = client.embeddings.create(input=[text], model=model).data[0].embedding
-       
-        return result
+        return get_embedding_service().embed(text, model=model)
     
@@ -0,0 +1,286 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from langchain_core.embeddings import Embeddings
+from openai import OpenAI
+
+DEFAULT_MODEL = "text-embedding-3-large"
+
+
+def normalize_text(text):
+    """
+    Canonical form of a text for cache keys: NFC, newlines and repeated whitespace collapsed.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class _Flight:
+    """
+    One in-progress OpenAI request for a cache key; other threads wait on it instead of repeating it.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.vector = None
+        self.error = None
+
+    def finish(self, vector=None, error=None):
+        self.vector, self.error = vector, error
+        self.event.set()
+
+    def wait(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise TimeoutError("embedding request of another thread did not finish")
+        if self.error is not None:
+            raise self.error
+        return self.vector
+
+
+class EmbeddingService:
+    """
+    Query embedding service with an in-memory LRU and a persistent SQLite tier.
+
+    Entries are keyed by model, dimensions and normalized text and stored as float32 blobs,
+    so the same text is embedded once per process (memory tier) and, across restarts, once
+    per cache file (disk tier). Misses of one call are sent to OpenAI in a single request.
+    A text that another thread is already embedding is not requested again: the caller waits
+    for that request (single flight), so the router, Hybrid and Pineg running concurrently on
+    the same query cost one OpenAI call. The disk tier keeps at most `max_disk_entries` vectors
+    no older than `max_age_days`. A caller waits at most `wait_timeout` seconds for another
+    thread's request and then embeds the text itself; a failed disk write is only logged.
+
+    Attributes:
+        path (str): SQLite file of the disk tier (EMBEDDING_CACHE_FILE, default 'embeddings.sqlite').
+        cache_size (int): Maximum number of vectors kept in memory.
+        max_disk_entries (int): Disk tier bound (EMBEDDING_CACHE_MAX_ENTRIES, default 200000).
+        max_age_days (float): Disk tier entry age limit (EMBEDDING_CACHE_MAX_AGE_DAYS, default 90).
+        wait_timeout (float): Longest wait for a request of another thread, in seconds.
+
+    Example usage:
+    service = EmbeddingService("embeddings.sqlite", cache_size=2048)
+    vector = service.embed("knjige o Drugom svetskom ratu")         # float32 array
+    matrix = service.embed_many(["prvo pitanje", "drugo pitanje"])  # float32 array, one row per text
+    service.stats()  # {'hit_ratio': 0.5, 'memory_bytes': 24576, 'disk_bytes': 40960, ...}
+    """
+
+    def __init__(self, path=None, model=DEFAULT_MODEL, dimensions=None, cache_size=2048, client=None,
+                 max_disk_entries=None, max_age_days=None, prune_every=1000, wait_timeout=30):
+        self.path = path if path is not None else os.getenv("EMBEDDING_CACHE_FILE", "embeddings.sqlite")
+        self.model = model
+        self.dimensions = dimensions
+        self.cache_size = cache_size
+        self.client = client if client is not None else OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.max_disk_entries = max_disk_entries if max_disk_entries is not None else int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+        self.max_age_days = max_age_days if max_age_days is not None else float(os.getenv("EMBEDDING_CACHE_MAX_AGE_DAYS", 90))
+        self.prune_every = prune_every
+        self.wait_timeout = wait_timeout
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight = {}  # key -> _Flight, tekstovi koje neka nit upravo salje OpenAI-u
+        self._inserted_since_prune = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "requests": 0, "coalesced": 0, "pruned": 0}
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT, dimensions INTEGER, vector BLOB, created_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+        self._db.commit()
+        with self._lock:
+            self._prune()
+
+    def _prune(self):
+        # poziva se pod self._lock; brisu se prestari, pa najstariji preko granice
+        cutoff = time.time() - self.max_age_days * 86400
+        pruned = self._db.execute("DELETE FROM embeddings WHERE created_at < ?", (cutoff,)).rowcount
+        pruned += self._db.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        ).rowcount
+        self._db.commit()
+        self._inserted_since_prune = 0
+        self._stats["pruned"] += max(pruned, 0)
+
+    @staticmethod
+    def key(text, model, dimensions):
+        raw = f"{model}|{dimensions or 0}|{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _request(self, inputs, model, dimensions):
+        params = {"input": inputs, "model": model}
+        if dimensions:
+            params["dimensions"] = dimensions
+        response = self.client.embeddings.create(**params)
+        vectors = [np.asarray(item.embedding, dtype=np.float32) for item in response.data]
+        for vector in vectors:
+            vector.flags.writeable = False
+        with self._lock:
+            self._stats["misses"] += len(inputs)
+            self._stats["requests"] += 1
+        return vectors
+
+    def _persist(self, rows):
+        # greska upisa (zakljucan fajl, pun disk) se samo loguje; vektori su vec u memoriji
+        with self._lock:
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+                self._db.commit()
+                self._inserted_since_prune += len(rows)
+                if self._inserted_since_prune >= self.prune_every:
+                    self._prune()
+            except sqlite3.Error as e:
+                print(f"Error saving embeddings to {self.path}: {e}")
+                try:
+                    self._db.rollback()
+                except sqlite3.Error:
+                    pass
+
+    def _remember(self, key, vector):
+        # poziva se pod self._lock
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while len(self._memory) > self.cache_size:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def embed_many(self, texts, model=None, dimensions=None):
+        """
+        Returns a float32 array with one embedding row per text, in input order.
+
+        Args:
+            texts (list): Texts to embed.
+            model (str, optional): Embedding model; defaults to the service model.
+            dimensions (int, optional): Requested output dimensions (text-embedding-3 models).
+        """
+        model = model or self.model
+        dimensions = dimensions or self.dimensions
+        keys = [self.key(text, model, dimensions) for text in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory and key not in found:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self._stats["memory_hits"] += 1
+
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            if missing:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing
+                ).fetchall()
+                for key, blob in rows:
+                    # frombuffer daje read-only niz, pa kesirani vektor ne moze da se izmeni
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self._stats["disk_hits"] += 1
+
+            # kljucevi koje vec trazi druga nit se cekaju, ostali se prijavljuju kao nasi
+            pending, waiting = {}, {}
+            for text, key in zip(texts, keys):
+                if key in found or key in pending or key in waiting:
+                    continue
+                if key in self._inflight:
+                    waiting[key] = (self._inflight[key], normalize_text(text))
+                    self._stats["coalesced"] += 1
+                else:
+                    pending[key] = normalize_text(text)
+                    self._inflight[key] = _Flight()
+
+        if pending:
+            try:
+                vectors = self._request(list(pending.values()), model, dimensions)
+            except Exception as e:
+                with self._lock:
+                    flights = [self._inflight.pop(key) for key in pending]
+                for flight in flights:
+                    flight.finish(error=e)
+                raise
+            # niti koje cekaju se oslobadjaju pre upisa na disk, pa ih greska SQLite-a ne blokira
+            with self._lock:
+                flights = []
+                for key, vector in zip(pending, vectors):
+                    found[key] = vector
+                    self._remember(key, vector)
+                    flights.append((self._inflight.pop(key), vector))
+            for flight, vector in flights:
+                flight.finish(vector=vector)
+            now = time.time()
+            self._persist([(key, model, dimensions or len(vector), vector.tobytes(), now) for key, vector in zip(pending, vectors)])
+
+        timed_out = {}
+        for key, (flight, text) in waiting.items():
+            try:
+                found[key] = flight.wait(self.wait_timeout)
+            except TimeoutError:
+                timed_out[key] = text
+        if timed_out:
+            # druga nit nije zavrsila na vreme; tekst se embeduje direktno, bez cekanja
+            print(f"Embedding wait timed out for {len(timed_out)} texts, requesting them directly.")
+            vectors = self._request(list(timed_out.values()), model, dimensions)
+            with self._lock:
+                for key, vector in zip(timed_out, vectors):
+                    found[key] = vector
+                    self._remember(key, vector)
+
+        if len(keys) == 1:
+            return found[keys[0]][np.newaxis]
+        return np.stack([found[key] for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+    def embed(self, text, model=None, dimensions=None):
+        """
+        Returns the embedding of one text as a read-only float32 array (the cached vector, not a copy).
+        """
+        return self.embed_many([text], model=model, dimensions=dimensions)[0]
+
+    def stats(self):
+        """
+        Returns hit counters, 'hit_ratio' over all lookups and the bytes held by both tiers.
+        """
+        with self._lock:
+            stats = dict(self._stats, memory_entries=len(self._memory), memory_bytes=self._memory_bytes)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["disk_bytes"] = sum(
+            os.path.getsize(path) for path in (self.path, self.path + "-wal") if os.path.exists(path)
+        )
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings adapter over EmbeddingService, for vector stores and retrievers.
+    """
+
+    def __init__(self, service, model=DEFAULT_MODEL, dimensions=None):
+        self.service = service
+        self.model = model
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts):
+        return self.service.embed_many(texts, model=self.model, dimensions=self.dimensions).tolist()
+
+    def embed_query(self, text):
+        return self.service.embed(text, model=self.model, dimensions=self.dimensions).tolist()
+
+
+@st.cache_resource
+def get_embedding_service():
+    return EmbeddingService()
@@ -0,0 +1,100 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def book_key(namespace, match):
+    """
+    Book identity of a match: the 'id' metadata field (same in opisi and korice), else the vector id.
+    """
+    metadata = match.get("metadata") or {}
+    return str(metadata.get("id") or match.get("id"))
+
+
+def reciprocal_rank_fusion(rankings, k=60, key=book_key):
+    """
+    Merges ranked match lists with reciprocal rank fusion: score = sum of 1 / (k + rank).
+
+    Args:
+        rankings (dict): {namespace: [match, ...]} with matches ordered best first.
+        k (int): RRF damping constant; 60 is the usual value.
+        key (callable): Returns the de-duplication key for (namespace, match).
+
+    Returns:
+        list: One entry per book, best first, with 'id', 'score', 'namespaces' (namespace -> rank),
+              'metadata' (merged, earlier namespaces win) and 'matches' (namespace -> match).
+    """
+    fused = {}
+    for namespace, matches in rankings.items():
+        for rank, match in enumerate(matches, start=1):
+            book_id = key(namespace, match)
+            entry = fused.setdefault(book_id, {"id": book_id, "score": 0.0, "namespaces": {}, "metadata": {}, "matches": {}})
+            if namespace in entry["namespaces"]:
+                continue
+            entry["score"] += 1.0 / (k + rank)
+            entry["namespaces"][namespace] = rank
+            entry["matches"][namespace] = match
+            for field, value in (match.get("metadata") or {}).items():
+                entry["metadata"].setdefault(field, value)
+    return sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)
+
+
+class FusionRetriever:
+    """
+    Queries several Pinecone namespaces concurrently with one query embedding and fuses the
+    results with reciprocal rank fusion, de-duplicated by book id.
+
+    The embedding is computed once and the namespace queries run in parallel on a shared
+    thread pool, so the wall-clock time is that of the slowest namespace call rather than
+    the sum.
+
+    Attributes:
+        namespaces (list): Namespaces to search (MULTI_NAMESPACES, default 'opisi,korice').
+        rrf_k (int): RRF damping constant.
+
+    Example usage:
+    retriever = FusionRetriever(index_for=connect_to_pinecone, embed=get_embedding_service().embed)
+    books = retriever.search("roman sa plavim koricama o moru", top_k=5)
+    # [{'id': '...', 'score': 0.0325, 'namespaces': {'opisi': 1, 'korice': 2}, 'metadata': {...}, ...}]
+    """
+
+    def __init__(self, index_for, embed, namespaces=None, rrf_k=60, max_workers=8):
+        if namespaces is None:
+            namespaces = [n.strip() for n in os.getenv("MULTI_NAMESPACES", "opisi,korice").split(",") if n.strip()]
+        self.index_for = index_for
+        self.embed = embed
+        self.namespaces = namespaces
+        self.rrf_k = rrf_k
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fusion")
+
+    def _query(self, namespace, vector, top_k, filter):
+        params = {"vector": vector, "top_k": top_k, "include_metadata": True, "namespace": namespace}
+        if filter:
+            params["filter"] = filter
+        return self.index_for(namespace).query(**params).to_dict().get("matches", [])
+
+    def search(self, query, top_k=5, filter=None, per_namespace_k=None):
+        """
+        Returns the fused, de-duplicated book list for `query` (at most `top_k` entries).
+
+        Args:
+            query (str): The user query.
+            top_k (int): Number of fused results.
+            filter (dict, optional): Pinecone metadata filter applied in every namespace.
+            per_namespace_k (int, optional): Candidates per namespace; defaults to 2 * top_k.
+        """
+        start = time.perf_counter()
+        vector = self.embed(query).tolist()
+        futures = {
+            namespace: self.executor.submit(self._query, namespace, vector, per_namespace_k or 2 * top_k, filter)
+            for namespace in self.namespaces
+        }
+        rankings = {}
+        for namespace, future in futures.items():
+            try:
+                rankings[namespace] = future.result()
+            except Exception as e:
+                print(f"Namespace '{namespace}' query failed: {e}")
+        fused = reciprocal_rank_fusion(rankings, k=self.rrf_k)[:top_k]
+        print(f"Fusion over {list(rankings)}: {len(fused)} books in {time.perf_counter() - start:.3f}s")
+        return fused
@@ -0,0 +1,141 @@
+import pyodbc
+
+# Sve izmene seme idu ovde kao nova verzija na kraju liste; primenjene verzije se ne menjaju.
+
+SCHEMA_VERSION_SQL = '''
+IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='schema_version' AND xtype='U')
+CREATE TABLE schema_version (
+    version INT NOT NULL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+)
+'''
+
+CONVERSATIONS_SQL = '''
+IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='conversations' AND xtype='U')
+CREATE TABLE conversations (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    app_name VARCHAR(255) NOT NULL,
+    user_name VARCHAR(255) NOT NULL,
+    thread_id VARCHAR(255) NOT NULL,
+    conversation NVARCHAR(MAX) NOT NULL
+)
+'''
+
+CONVERSATION_MESSAGES_SQL = '''
+IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='conversation_messages' AND xtype='U')
+CREATE TABLE conversation_messages (
+    app_name VARCHAR(255) NOT NULL,
+    user_name VARCHAR(255) NOT NULL,
+    thread_id VARCHAR(255) NOT NULL,
+    seq INT NOT NULL,
+    role VARCHAR(32) NOT NULL,
+    message NVARCHAR(MAX) NOT NULL,
+    created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+    CONSTRAINT PK_conversation_messages PRIMARY KEY (app_name, user_name, thread_id, seq)
+)
+'''
+
+# extract_token_sums_between_dates filtrira po vremenu i sabira tokene; INCLUDE pokriva ceo upit
+TOKEN_LOG_INDEX_SQL = '''
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_chatbot_token_log_timestamp')
+CREATE NONCLUSTERED INDEX IX_chatbot_token_log_timestamp
+ON chatbot_token_log ([timestamp])
+INCLUDE (embedding_tokens, prompt_tokens, completion_tokens, stt_tokens, tts_tokens)
+'''
+
+
+def unique_thread_constraint(db):
+    # UQ indeks (app_name, user_name, thread_id) je i indeks za record_exists/query/update/delete,
+    # a posto sadrzi thread_id pokriva i list_threads (WHERE app_name, user_name).
+    # Duplikati se ne brisu pri startu: korak se preskace (ostale migracije se primenjuju) i ponavlja
+    # pri sledecem startu, dok operater ne pokrene various/deduplicate_conversations.py
+    if not db.ensure_unique_thread_constraint(deduplicate=False):
+        print("UQ_conversations_thread not added; run various/deduplicate_conversations.py to remove duplicate threads.")
+        return False
+
+
+def copy_conversations_to_messages(db):
+    db.migrate_conversations_to_messages()
+
+
+def token_log_index(db):
+    # tabelu pravi token logger; dok ne postoji, verzija se ne belezi i korak se ponavlja pri sledecem startu
+    db.cursor.execute("SELECT OBJECT_ID('chatbot_token_log', 'U')")
+    if db.cursor.fetchone()[0] is None:
+        return False
+    db.cursor.execute(TOKEN_LOG_INDEX_SQL)
+
+
+# (verzija, naziv, SQL ili funkcija koja prima ConversationDatabase); svaki korak je idempotentan,
+# a funkcija koja vrati False nije primenjena i verzija joj se ne belezi
+MIGRATIONS = [
+    (1, "create conversations", CONVERSATIONS_SQL),
+    (2, "unique (app_name, user_name, thread_id) on conversations", unique_thread_constraint),
+    (3, "create conversation_messages", CONVERSATION_MESSAGES_SQL),
+    (4, "copy conversation JSON to conversation_messages", copy_conversations_to_messages),
+    (5, "timestamp index on chatbot_token_log", token_log_index),
+]
+
+
+def applied_versions(db):
+    db.cursor.execute(SCHEMA_VERSION_SQL)
+    db.conn.commit()
+    db.cursor.execute("SELECT version FROM schema_version")
+    return {row[0] for row in db.cursor.fetchall()}
+
+
+def run_migrations(db, migrations=MIGRATIONS):
+    """
+    Applies the migrations that are not recorded in schema_version yet, in version order.
+
+    An exclusive application lock serializes concurrent app instances starting at the same
+    time; every step is idempotent, so a step interrupted before its version was recorded
+    is simply run again. A callable step that returns False (e.g. its table does not exist
+    yet) is not recorded and is retried on the next run.
+
+    Args:
+        db (ConversationDatabase): An open database (inside `with`).
+        migrations (list): (version, name, sql or callable(db)) tuples.
+
+    Returns:
+        int: The highest applied schema version after the run.
+
+    Example usage:
+    with ConversationDatabase() as db:
+        version = run_migrations(db)
+    """
+    db.cursor.execute('''
+    SET NOCOUNT ON;
+    DECLARE @result INT;
+    EXEC @result = sp_getapplock @Resource = 'klotbot_migrations', @LockMode = 'Exclusive',
+                                 @LockOwner = 'Session', @LockTimeout = 60000;
+    SELECT @result;
+    ''')
+    if db.cursor.fetchone()[0] < 0:
+        raise TimeoutError("Could not acquire the migration lock")
+    try:
+        applied = applied_versions(db)
+        for version, name, step in sorted(migrations, key=lambda migration: migration[0]):
+            if version in applied:
+                continue
+            try:
+                if callable(step):
+                    if step(db) is False:
+                        db.conn.commit()
+                        print(f"Migration {version} ({name}) skipped, will be retried.")
+                        continue
+                else:
+                    db.cursor.execute(step)
+                db.cursor.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+                db.conn.commit()
+            except pyodbc.Error as e:
+                db.conn.rollback()
+                print(f"Migration {version} ({name}) failed: {e}")
+                raise
+            applied.add(version)
+            print(f"Applied migration {version}: {name}")
+        return max(applied, default=0)
+    finally:
+        db.cursor.execute("EXEC sp_releaseapplock @Resource = 'klotbot_migrations', @LockOwner = 'Session'")
+        db.conn.commit()
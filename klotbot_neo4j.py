@@ -0,0 +1,349 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import neo4j
+from klotbot_text import fold
+
+# Indeksi koje graphp/pineg ocekuju. Fulltext indeksi koriste 'standard-folding'
+# analyzer, pa se č/ć/š/ž/đ porede kao c/s/z/d.
+FULLTEXT_INDEXES = {
+    ("Book", "title"): "book_title_fulltext",
+    ("Author", "name"): "author_name_fulltext",
+}
+
+INDEX_STATEMENTS = {
+    "book_title_fulltext": (
+        "CREATE FULLTEXT INDEX book_title_fulltext IF NOT EXISTS FOR (b:Book) ON EACH [b.title] "
+        "OPTIONS {indexConfig: {`fulltext.analyzer`: 'standard-folding'}}"
+    ),
+    "author_name_fulltext": (
+        "CREATE FULLTEXT INDEX author_name_fulltext IF NOT EXISTS FOR (a:Author) ON EACH [a.name] "
+        "OPTIONS {indexConfig: {`fulltext.analyzer`: 'standard-folding'}}"
+    ),
+    "book_id_range": "CREATE RANGE INDEX book_id_range IF NOT EXISTS FOR (b:Book) ON (b.id)",
+    "book_old_product_id_range": (
+        "CREATE RANGE INDEX book_old_product_id_range IF NOT EXISTS FOR (b:Book) ON (b.oldProductId)"
+    ),
+}
+
+LUCENE_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+# engleske stop reci koje 'standard-folding' analyzer izbacuje pri indeksiranju; kao obavezni termin ne nalaze nista
+LUCENE_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it", "no", "not",
+    "of", "on", "or", "such", "that", "the", "their", "then", "there", "these", "they", "this", "to", "was",
+    "will", "with",
+}
+# kraci termini kao prefiks pogadjaju skoro svaki naslov
+MIN_LUCENE_TERM = 3
+CLAUSE_KEYWORDS = r"\b(?:WITH|MATCH|OPTIONAL|RETURN|CALL|UNWIND|ORDER|SKIP|LIMIT)\b"
+
+
+def ensure_indexes(driver, wait_seconds=300):
+    """
+    Creates the full-text and range indexes used by the graph tools if they do not exist
+    and waits until they are online.
+    """
+    with driver.session() as session:
+        for name, statement in INDEX_STATEMENTS.items():
+            session.run(statement).consume()
+            print(f"Index ensured: {name}")
+        if wait_seconds:
+            session.run("CALL db.awaitIndexes($timeout)", timeout=wait_seconds).consume()
+    return check_indexes(driver)
+
+
+def check_indexes(driver):
+    """
+    Returns the state of every expected index ('ONLINE', 'POPULATING', 'FAILED' or 'MISSING').
+    """
+    with driver.session() as session:
+        records = session.run("SHOW INDEXES YIELD name, state")
+        states = {record["name"]: record["state"] for record in records}
+    return {name: states.get(name, "MISSING") for name in INDEX_STATEMENTS}
+
+
+def fulltext_available(driver):
+    """
+    True when both full-text indexes are online and the rewriter can be used.
+    """
+    try:
+        states = check_indexes(driver)
+    except neo4j.exceptions.Neo4jError as e:
+        print(f"Error checking indexes: {e}")
+        return False
+    return all(states[name] == "ONLINE" for name in FULLTEXT_INDEXES.values())
+
+
+def lucene_query(terms):
+    """
+    Builds a Lucene query requiring every term as a prefix, e.g. ['ana', 'karenjin'] -> 'ana* AND karenjin*'.
+    Analyzer stopwords and words shorter than MIN_LUCENE_TERM (except numbers) are left out;
+    returns '' when nothing remains, so the caller keeps its CONTAINS predicate.
+    """
+    words = []
+    for term in terms:
+        for word in re.findall(r"\w+", fold(term)):
+            if word in LUCENE_STOPWORDS or (len(word) < MIN_LUCENE_TERM and not word.isdigit()):
+                continue
+            words.append(LUCENE_SPECIAL.sub(r"\\\1", word) + "*")
+    return " AND ".join(words)
+
+
+def top_level_conjuncts(clause):
+    """
+    Splits a WHERE clause on top-level AND (outside brackets and strings).
+    Returns None if the clause has a top-level OR/XOR, so a conjunct cannot be removed safely.
+    """
+    parts, depth, quote, start, i = [], 0, None, 0, 0
+    while i < len(clause):
+        char = clause[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif depth == 0 and (i == 0 or not (clause[i - 1].isalnum() or clause[i - 1] == "_")):
+            word = re.match(r"(AND|X?OR)\b", clause[i:], re.IGNORECASE)
+            if word and word.group(1).upper() != "AND":
+                return None
+            if word:
+                parts.append(clause[start:i])
+                i += len(word.group(1))
+                start = i
+                continue
+        i += 1
+    parts.append(clause[start:])
+    return [part.strip() for part in parts]
+
+
+def rewrite_contains_to_fulltext(cypher_query, params=None):
+    """
+    Rewrites the first `toLower(x.title|name) CONTAINS ...` predicate of the first WHERE clause
+    into a `db.index.fulltext.queryNodes` call, so Neo4j uses the index instead of a label scan.
+    Only a predicate that is a top-level AND conjunct is rewritten; under OR, NOT or inside
+    parentheses the query is left unchanged.
+
+    Handles both LLM generated literals (`CONTAINS toLower('Piramide')`) and the template form
+    from klotbot_cypher (`ALL(w IN $title WHERE toLower(b.title) CONTAINS w)`).
+
+    Returns:
+        tuple: (cypher_query, params). The query is returned unchanged if nothing can be rewritten.
+    """
+    params = dict(params or {})
+    labels = dict(re.findall(r"\((\w+):(\w+)", cypher_query))
+    where = re.search(r"\bWHERE\b", cypher_query)
+    if not where or not cypher_query.lstrip().upper().startswith("MATCH"):
+        return cypher_query, params
+    clause_end = re.search(CLAUSE_KEYWORDS, cypher_query[where.end():])
+    end = where.end() + clause_end.start() if clause_end else len(cypher_query)
+    clause = cypher_query[where.end():end]
+
+    predicate = (
+        r"ALL\(w IN \$(?P<param>\w+) WHERE toLower\((?P<alias>\w+)\.(?P<prop>\w+)\) CONTAINS w\)"
+        r"|toLower\((?P<alias2>\w+)\.(?P<prop2>\w+)\)\s+CONTAINS\s+toLower\('(?P<literal>[^']*)'\)"
+    )
+    # prepisuje se samo predikat koji je ceo AND clan WHERE klauzule; uz OR, NOT ili zagrade upit ostaje isti
+    conjuncts = top_level_conjuncts(clause)
+    if not conjuncts or not all(conjuncts):
+        return cypher_query, params
+    for position, conjunct in enumerate(conjuncts):
+        match = re.fullmatch(predicate, conjunct)
+        if match is None:
+            continue
+        alias = match.group("alias") or match.group("alias2")
+        prop = match.group("prop") or match.group("prop2")
+        index_name = FULLTEXT_INDEXES.get((labels.get(alias), prop))
+        if index_name is None:
+            continue
+        if match.group("param"):
+            terms = params.get(match.group("param")) or []
+        else:
+            terms = [match.group("literal")]
+        search = lucene_query(terms)
+        if not search:
+            continue
+
+        rest = conjuncts[:position] + conjuncts[position + 1:]
+        new_where = " WHERE " + " AND ".join(rest) + " " if rest else " "
+        param_name = f"ft_{alias}_{prop}"
+        params[param_name] = search
+        rewritten = (
+            f"CALL db.index.fulltext.queryNodes('{index_name}', ${param_name}) YIELD node AS {alias} "
+            + cypher_query[:where.start()].rstrip()
+            + new_where
+            + cypher_query[end:].lstrip()
+        )
+        return rewritten.strip(), params
+    return cypher_query, params
+
+
+def clean_record(record):
+    """
+    Flattens a Neo4j record into a dict: Node values contribute their properties and
+    'b.title' style keys lose their alias prefix.
+    """
+    cleaned_record = {}
+    for key, value in record.items():
+        if isinstance(value, neo4j.graph.Node):
+            # Ako je vrednost Node objekat, pristupamo properties atributima
+            properties = dict(value.items())
+        else:
+            properties = {key: value}
+        for prop_key, prop_value in properties.items():
+            cleaned_record[prop_key.split('.')[-1]] = prop_value
+    return cleaned_record
+
+
+def add_limit(cypher_query, limit, param_name="row_limit"):
+    """
+    Appends `LIMIT $row_limit` to a query. A trailing literal LIMIT is kept if it is smaller
+    and replaced otherwise.
+
+    Returns:
+        tuple: (cypher_query, limit_from_budget) where the flag tells whether the budget LIMIT is in effect.
+    """
+    existing = re.search(r"\bLIMIT\s+(\d+)\s*;?\s*$", cypher_query, re.IGNORECASE)
+    if existing:
+        if int(existing.group(1)) <= limit:
+            return cypher_query, False
+        cypher_query = cypher_query[:existing.start()]
+    return f"{cypher_query.rstrip().rstrip(';')} LIMIT ${param_name}", True
+
+
+def run_budgeted_query(driver, cypher_query, params=None, max_characters=100000, min_record_chars=50, fetch_size=100):
+    """
+    Runs a Cypher query and consumes it lazily until the character budget is reached.
+
+    The server side LIMIT is derived from the budget (`max_characters // min_record_chars`),
+    rows are pulled in batches of `fetch_size` and every record is measured once.
+
+    Args:
+        driver: Neo4j driver.
+        cypher_query (str): The query to run.
+        params (dict, optional): Query parameters.
+        max_characters (int): Character budget for all returned values.
+        min_record_chars (int): Smallest expected record size, used to derive the LIMIT.
+        fetch_size (int): Number of records pulled from the server per batch.
+
+    Returns:
+        tuple: (records, stats) where stats has 'rows', 'characters', 'bytes', 'limit' and 'truncated'.
+    """
+    params = dict(params or {})
+    limit = max(1, max_characters // min_record_chars)
+    cypher_query, limit_from_budget = add_limit(cypher_query, limit)
+    params["row_limit"] = limit
+    cleaned_results = []
+    stats = {"rows": 0, "characters": 0, "bytes": 0, "limit": limit, "truncated": False}
+
+    with driver.session(fetch_size=fetch_size) as session:
+        results = session.run(cypher_query, params)
+        for record in results:
+            cleaned_record = clean_record(record)
+            text = "".join(str(value) for value in cleaned_record.values())
+            if stats["characters"] + len(text) > max_characters:
+                # ostatak rezultata se ne preuzima sa servera
+                stats["truncated"] = True
+                break
+            cleaned_results.append(cleaned_record)
+            stats["characters"] += len(text)
+            stats["bytes"] += len(text.encode("utf-8"))
+        stats["rows"] = len(cleaned_results)
+        if limit_from_budget and stats["rows"] >= limit:
+            stats["truncated"] = True
+    return cleaned_results, stats
+
+
+BOOK_FIELDS = ['id', 'oldProductId', 'title', 'category', 'price', 'quantity', 'pages', 'eBook']
+
+
+class BookCache:
+    """
+    In-process LRU of Book records keyed by id, so popular titles skip Neo4j.
+
+    Entries expire after `ttl` seconds because price and quantity change over time.
+    """
+
+    def __init__(self, maxsize=2048, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, ids):
+        """
+        Returns {id: record} for the cached ids; expired entries are dropped.
+        """
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for book_id in ids:
+                entry = self._data.get(book_id)
+                if entry is not None and now - entry[0] < self.ttl:
+                    self._data.move_to_end(book_id)
+                    found[book_id] = dict(entry[1])
+                    self.hits += 1
+                else:
+                    self._data.pop(book_id, None)
+                    self.misses += 1
+        return found
+
+    def put_many(self, books):
+        now = time.monotonic()
+        with self._lock:
+            for book_id, book in books.items():
+                self._data[book_id] = (now, dict(book))
+                self._data.move_to_end(book_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+def fetch_books(driver, ids, cache=None):
+    """
+    Fetches Book records for a list of ids with a single `UNWIND` query.
+
+    Cached ids are served from `cache` and only the rest go to Neo4j. The read runs as a
+    managed transaction, so transient errors are retried by the driver.
+
+    Args:
+        driver: Neo4j driver.
+        ids (list): Book ids, e.g. in Pinecone ranking order.
+        cache (BookCache, optional): Record cache.
+
+    Returns:
+        list: Book dicts in the order of `ids`; ids not found in the graph are skipped.
+    """
+    books = cache.get_many(ids) if cache is not None else {}
+    missing = list(dict.fromkeys(book_id for book_id in ids if book_id not in books))
+
+    def read_books(tx):
+        result = tx.run("UNWIND $ids AS id MATCH (b:Book {id: id}) RETURN b", ids=missing)
+        return {record['b']['id']: {field: record['b'].get(field) for field in BOOK_FIELDS} for record in result}
+
+    if missing:
+        with driver.session() as session:
+            fetched = session.execute_read(read_books)
+        books.update(fetched)
+        if cache is not None:
+            cache.put_many(fetched)
+    return [dict(books[book_id]) for book_id in ids if book_id in books]
+
+
+if __name__ == "__main__":
+    # jednokratno kreiranje indeksa: python klotbot_neo4j.py
+    driver = neo4j.GraphDatabase.driver(os.getenv("NEO4J_URI"), auth=(os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASS")))
+    print(ensure_indexes(driver))
+    driver.close()
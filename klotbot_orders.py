@@ -0,0 +1,110 @@
+import csv
+import io
+import mmap
+import os
+import threading
+
+BOM = b"\xef\xbb\xbf"
+
+
+class OrderIndex:
+    """
+    Hash index over orders.csv mapping order number to the byte offset of its row.
+
+    The index is built once and checked against the file's mtime and size on every lookup.
+    When the file only grew (rows appended), just the new tail is indexed; any other change
+    rebuilds the index. Indexing scans a memory map of the file; a lookup is a dict probe,
+    one seek and one row parse instead of a scan of the whole file.
+
+    Example usage:
+    index = OrderIndex("orders.csv")
+    index.lookup(123456)             # "123456, ..., ..." or None
+    index.lookup_many([123456, 7])  # {123456: "...", 7: None}
+    """
+
+    def __init__(self, path="orders.csv"):
+        self.path = path
+        self.offsets = {}
+        self._signature = None
+        self._tail = b""
+        self._lock = threading.Lock()
+
+    def _scan(self, data, start):
+        """
+        Indexes rows of `data` beginning at byte `start`; quoted fields may span lines.
+        """
+        position = start
+        size = len(data)
+        while position < size:
+            end = data.find(b"\n", position)
+            end = size if end == -1 else end + 1
+            # red sa neparnim brojem navodnika se nastavlja u sledecoj liniji
+            while data[position:end].count(b'"') % 2 and end < size:
+                next_end = data.find(b"\n", end)
+                end = size if next_end == -1 else next_end + 1
+            key = data[position:end].split(b",", 1)[0].strip().strip(b'"')
+            try:
+                self.offsets.setdefault(int(key), (position, end - position))
+            except ValueError:
+                pass
+            position = end
+
+    def refresh(self):
+        """
+        Brings the index up to date with the file. Returns False if the file does not exist.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return True
+
+        with open(self.path, "rb") as file:
+            if stat.st_size == 0:
+                self.offsets, self._signature, self._tail = {}, signature, b""
+                return True
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                old_size = self._signature[1] if self._signature else 0
+                appended = (
+                    self._signature is not None
+                    and stat.st_size > old_size
+                    and data[max(0, old_size - len(self._tail)):old_size] == self._tail
+                    and data[old_size - 1:old_size] == b"\n"
+                )
+                if appended:
+                    self._scan(data, old_size)
+                else:
+                    self.offsets = {}
+                    start = len(BOM) if data[:len(BOM)] == BOM else 0
+                    header_end = data.find(b"\n", start)
+                    self._scan(data, len(data) if header_end == -1 else header_end + 1)
+                self._tail = data[max(0, stat.st_size - 64):stat.st_size]
+        self._signature = signature
+        return True
+
+    def lookup_many(self, order_numbers):
+        """
+        Returns {order_number: row as a comma separated string, or None if unknown}.
+
+        Raises:
+            FileNotFoundError: If the orders file does not exist.
+        """
+        with self._lock:
+            if not self.refresh():
+                raise FileNotFoundError(self.path)
+            locations = {number: self.offsets.get(int(number)) for number in order_numbers}
+        rows = {}
+        with open(self.path, "rb") as file:
+            for number, location in locations.items():
+                if location is None:
+                    rows[number] = None
+                    continue
+                file.seek(location[0])
+                line = file.read(location[1]).decode("utf-8")
+                rows[number] = ", ".join(next(csv.reader(io.StringIO(line))))
+        return rows
+
+    def lookup(self, order_number):
+        return self.lookup_many([order_number])[order_number]
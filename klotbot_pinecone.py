@@ -0,0 +1,105 @@
+import os
+import threading
+import streamlit as st
+from pinecone import Pinecone
+
+DELFI_HOST = "https://delfi-a9w1e6k.svc.aped-4627-b74a.pinecone.io"
+NEO_POSITIVE_HOST = "https://neo-positive-a9w1e6k.svc.apw5-4e34-81fa.pinecone.io"
+
+
+class PineconeIndexRegistry:
+    """
+    Thread-safe, process-wide registry of Pinecone index handles keyed by host and namespace.
+
+    One client and one index object are created per host and transport and then reused, so
+    queries go over already open keep-alive connections instead of paying client construction
+    and a new TLS handshake. The gRPC client (as in various/upsert.py) can be used instead of
+    HTTP with PINECONE_USE_GRPC=1.
+
+    Attributes:
+        pool_threads (int): Threads of the client's pool for async_req calls, e.g. parallel
+            upserts (PINECONE_POOL_THREADS). It does not size the urllib3 connection pool, which
+            keeps the client default; synchronous queries reuse its keep-alive connections.
+        use_grpc (bool): Default transport for `get`.
+
+    Example usage:
+    registry = PineconeIndexRegistry(pool_threads=8)
+    registry.warmup([(DELFI_HOST, "opisi")])
+    index = registry.get(DELFI_HOST, "opisi")
+    """
+
+    def __init__(self, api_key=None, pool_threads=None, use_grpc=None):
+        self.api_key = api_key if api_key is not None else os.getenv("PINECONE_API_KEY")
+        self.pool_threads = pool_threads if pool_threads is not None else int(os.getenv("PINECONE_POOL_THREADS", 4))
+        self.use_grpc = use_grpc if use_grpc is not None else os.getenv("PINECONE_USE_GRPC", "0") == "1"
+        self._clients = {}
+        self._indexes = {}
+        self._handles = {}
+        self._hosts_by_name = {}
+        self._lock = threading.Lock()
+
+    def _client(self, transport):
+        if transport not in self._clients:
+            if transport == "grpc":
+                from pinecone.grpc import PineconeGRPC
+                self._clients[transport] = PineconeGRPC(api_key=self.api_key)
+            else:
+                self._clients[transport] = Pinecone(api_key=self.api_key, pool_threads=self.pool_threads)
+        return self._clients[transport]
+
+    def get(self, host, namespace=None, grpc=None):
+        """
+        Returns the shared index handle for a host; namespaces on the same host share connections.
+
+        Args:
+            host (str): Index host URL.
+            namespace (str, optional): Namespace the caller will query.
+            grpc (bool, optional): Force the gRPC (True) or HTTP (False) client, e.g. for LangChain
+                which only accepts the HTTP index.
+        """
+        transport = "grpc" if (self.use_grpc if grpc is None else grpc) else "http"
+        key = (host, namespace, transport)
+        handle = self._handles.get(key)
+        if handle is None:
+            with self._lock:
+                if (transport, host) not in self._indexes:
+                    client = self._client(transport)
+                    if transport == "grpc":
+                        self._indexes[(transport, host)] = client.Index(host=host)
+                    else:
+                        self._indexes[(transport, host)] = client.Index(host=host, pool_threads=self.pool_threads)
+                handle = self._handles.setdefault(key, self._indexes[(transport, host)])
+        return handle
+
+    def get_by_name(self, index_name, namespace=None, grpc=None):
+        """
+        Like `get`, but resolves the host from the index name once (same as from_existing_index).
+        """
+        host = self._hosts_by_name.get(index_name)
+        if host is None:
+            with self._lock:
+                host = self._client("http").describe_index(index_name).host
+            if not host.startswith("https://"):
+                host = "https://" + host
+            self._hosts_by_name[index_name] = host
+        return self.get(host, namespace, grpc=grpc)
+
+    def warmup(self, targets):
+        """
+        Creates the handles for (host, namespace) pairs and opens their connections with a
+        cheap describe_index_stats call. Failures are printed, not raised.
+        """
+        for host, namespace in targets:
+            try:
+                self.get(host, namespace).describe_index_stats()
+                print(f"Pinecone warmup: {host} / {namespace}")
+            except Exception as e:
+                print(f"Pinecone warmup failed for {host}: {e}")
+
+
+@st.cache_resource
+def get_pinecone_registry():
+    registry = PineconeIndexRegistry()
+    # otvaramo konekcije ka indeksima koje bot koristi pre prvog upita
+    registry.warmup([(DELFI_HOST, "opisi"), (DELFI_HOST, "korice"), (NEO_POSITIVE_HOST, os.getenv("NAMESPACE"))])
+    return registry
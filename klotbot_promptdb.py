@@ -2,6 +2,8 @@ import json
 import os
 import pyodbc
 import streamlit as st
+from klotbot_dbpool import get_connection_pool, is_broken
+from klotbot_migrations import run_migrations
 
 class ConversationDatabase:
     """
@@ -12,19 +14,15 @@ class ConversationDatabase:
         self.user = user if user is not None else os.getenv('MSSQL_USER')
         self.password = password if password is not None else os.getenv('MSSQL_PASS')
         self.database = database if database is not None else os.getenv('MSSQL_DB')
+        self.pool = None
         self.conn = None
         self.cursor = None
 
     def __enter__(self):
         try:
-            self.conn = pyodbc.connect(
-                driver='{ODBC Driver 18 for SQL Server}',
-                server=self.host,
-                database=self.database,
-                uid=self.user,
-                pwd=self.password,
-                TrustServerCertificate='yes'
-            )
+            # konekcija se uzima iz zajednickog pool-a umesto novog pyodbc.connect
+            self.pool = get_connection_pool(self.host, self.user, self.password, self.database)
+            self.conn = self.pool.acquire()
             self.cursor = self.conn.cursor()
         except Exception as e:
             print(f"Error connecting to the database: {e}")
@@ -34,29 +32,19 @@ class ConversationDatabase:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.cursor is not None:
             self.cursor.close()
+            self.cursor = None
         if self.conn is not None:
-            self.conn.close()
+            self.pool.release(self.conn, broken=exc_val is not None and is_broken(exc_val))
+            self.conn = None
         if exc_type or exc_val or exc_tb:
             print(f"Exception occurred: {exc_type}, {exc_val}")
             pass
 
     def create_sql_table(self):
-        check_table_sql = '''
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='conversations' AND xtype='U')
-        CREATE TABLE conversations (
-            id INT IDENTITY(1,1) PRIMARY KEY,
-            app_name VARCHAR(255) NOT NULL,
-            user_name VARCHAR(255) NOT NULL,
-            thread_id VARCHAR(255) NOT NULL,
-            conversation NVARCHAR(MAX) NOT NULL
-        )
-        '''
-        try:
-            self.cursor.execute(check_table_sql)
-            self.conn.commit()
-        except Exception as e:
-            print(f"Error creating table: {e}")
-            raise
+        """
+        Creates or upgrades the conversation tables by applying pending schema migrations.
+        """
+        return run_migrations(self)
 
     def update_sql_record(self, app_name, user_name, thread_id, new_conversation):
         """
@@ -132,14 +120,266 @@ class ConversationDatabase:
             print(f"Error adding record: {e}")
             self.conn.rollback()
 
+    def upsert_sql_record(self, app_name, user_name, thread_id, new_conversation):
+        """
+        Updates the conversation or inserts it if the thread does not exist, in one atomic batch.
+
+        UPDLOCK + SERIALIZABLE hold a key-range lock from the UPDATE until the INSERT, so two
+        sessions saving the same new thread cannot both insert; the unique constraint
+        UQ_conversations_thread is the backstop.
+        Only the JSON column is written; threads are saved message by message with sync_messages.
+
+        Parameters:
+        - app_name: The name of the application.
+        - user_name: The name of the user.
+        - thread_id: The thread identifier (string).
+        - new_conversation: The conversation data as a list of dictionaries.
+
+        Returns:
+        - 'inserted' or 'updated', or None if the statement failed.
+        """
+        conversation_json = json.dumps(new_conversation)
+        upsert_sql = '''
+        SET NOCOUNT ON;
+        DECLARE @inserted BIT = 0;
+        UPDATE conversations WITH (UPDLOCK, SERIALIZABLE)
+        SET conversation = ?
+        WHERE app_name = ? AND user_name = ? AND thread_id = ?;
+        IF @@ROWCOUNT = 0
+        BEGIN
+            INSERT INTO conversations (app_name, user_name, thread_id, conversation)
+            VALUES (?, ?, ?, ?);
+            SET @inserted = 1;
+        END
+        SELECT @inserted;
+        '''
+        params = (conversation_json, app_name, user_name, thread_id,
+                  app_name, user_name, thread_id, conversation_json)
+        try:
+            self.cursor.execute(upsert_sql, params)
+            inserted = self.cursor.fetchone()[0]
+            self.conn.commit()
+            return "inserted" if inserted else "updated"
+        except pyodbc.Error as e:
+            print(f"Error upserting record: {e}")
+            self.conn.rollback()
+            return None
+
     def update_or_insert_sql_record(self, app_name, user_name, thread_id, new_conversation):
-        if self.record_exists(app_name, user_name, thread_id):
-            self.update_sql_record(app_name, user_name, thread_id, new_conversation)
-        else:
-            self.add_sql_record(app_name, user_name, thread_id, new_conversation)
+        return self.sync_messages(app_name, user_name, thread_id, new_conversation)
+
+    def _insert_messages(self, app_name, user_name, thread_id, messages, start_seq):
+        insert_sql = '''
+        INSERT INTO conversation_messages (app_name, user_name, thread_id, seq, role, message)
+        VALUES (?, ?, ?, ?, ?, ?)
+        '''
+        rows = [(app_name, user_name, thread_id, start_seq + i, str(message.get('role', '')), json.dumps(message))
+                for i, message in enumerate(messages)]
+        if rows:
+            self.cursor.fast_executemany = True
+            self.cursor.executemany(insert_sql, rows)
+
+    def sync_messages(self, app_name, user_name, thread_id, messages, rewrite=False):
+        """
+        Persists the thread by appending only the messages that are not stored yet.
+
+        `messages` is the full conversation as kept in the session. Stored messages are never
+        rewritten: messages[stored_count:] are inserted. If the list is shorter than what is
+        stored, or its message at the last stored position differs from the stored one (the
+        conversation was reset and grew again), the stored messages are replaced.
+        `rewrite=True` replaces them unconditionally.
+
+        Parameters:
+        - app_name: The name of the application.
+        - user_name: The name of the user.
+        - thread_id: The thread identifier (string).
+        - messages: The full conversation as a list of dictionaries.
+        - rewrite: Replace all stored messages instead of appending.
+
+        Returns:
+        - Number of messages written, or None if the write failed.
+        """
+        # zaglavlje niti se pravi ako ne postoji; UPDLOCK na porukama serijalizuje istovremene upise iste niti.
+        # JSON kolona se prazni: od prvog upisa poruka nit je samo u conversation_messages
+        header_sql = '''
+        SET NOCOUNT ON;
+        IF NOT EXISTS (SELECT 1 FROM conversations WITH (UPDLOCK, SERIALIZABLE)
+                       WHERE app_name = ? AND user_name = ? AND thread_id = ?)
+            INSERT INTO conversations (app_name, user_name, thread_id, conversation)
+            VALUES (?, ?, ?, N'[]');
+        ELSE
+            UPDATE conversations SET conversation = N'[]'
+            WHERE app_name = ? AND user_name = ? AND thread_id = ? AND conversation <> N'[]';
+        SELECT TOP (1) seq + 1, message FROM conversation_messages WITH (UPDLOCK, SERIALIZABLE)
+        WHERE app_name = ? AND user_name = ? AND thread_id = ?
+        ORDER BY seq DESC;
+        '''
+        key = (app_name, user_name, thread_id)
+        try:
+            self.cursor.execute(header_sql, key * 4)
+            last = self.cursor.fetchone()
+            stored = last[0] if last else 0
+            # poredi se poslednja sacuvana poruka, pa se prepoznaje i reset posle kog je nit ponovo narasla
+            if rewrite or len(messages) < stored or (stored and json.loads(last[1]) != messages[stored - 1]):
+                self.cursor.execute('''
+                DELETE FROM conversation_messages
+                WHERE app_name = ? AND user_name = ? AND thread_id = ?
+                ''', key)
+                stored = 0
+            new_messages = messages[stored:]
+            self._insert_messages(app_name, user_name, thread_id, new_messages, stored)
+            self.conn.commit()
+            return len(new_messages)
+        except pyodbc.Error as e:
+            print(f"Error saving messages: {e}")
+            self.conn.rollback()
+            return None
+
+    def load_messages(self, app_name, user_name, thread_id, last_n=None, before_seq=None):
+        """
+        Loads messages of a thread in conversation order.
+
+        Parameters:
+        - app_name: The name of the application.
+        - user_name: The name of the user.
+        - thread_id: The thread identifier (string).
+        - last_n: Return only the last N messages (all if None).
+        - before_seq: Only messages with seq < before_seq, for paging backwards.
+
+        Returns:
+        - List of (seq, message) tuples, oldest first.
+        """
+        query_sql = f'''
+        SELECT {"TOP (?) " if last_n is not None else ""}seq, message FROM conversation_messages
+        WHERE app_name = ? AND user_name = ? AND thread_id = ?{" AND seq < ?" if before_seq is not None else ""}
+        ORDER BY seq DESC
+        '''
+        params = ([last_n] if last_n is not None else []) + [app_name, user_name, thread_id]
+        if before_seq is not None:
+            params.append(before_seq)
+        try:
+            self.cursor.execute(query_sql, params)
+            rows = self.cursor.fetchall()
+            return [(row[0], json.loads(row[1])) for row in reversed(rows)]
+        except Exception as e:
+            print(f"Error loading messages: {e}")
+            raise
+
+    def page_messages(self, app_name, user_name, thread_id, page_size=50, before_seq=None):
+        """
+        Returns one page of messages going backwards from `before_seq` (from the newest if None).
+
+        Returns:
+        - (messages, next_before_seq): messages oldest first, and the value to pass as
+          before_seq for the previous page, or None when the start of the thread was reached.
+
+        Example usage:
+        messages, cursor = db.page_messages("delfi", "user", thread_id, page_size=20)
+        older, cursor = db.page_messages("delfi", "user", thread_id, page_size=20, before_seq=cursor)
+        """
+        rows = self.load_messages(app_name, user_name, thread_id, last_n=page_size, before_seq=before_seq)
+        next_before_seq = rows[0][0] if rows and rows[0][0] > 0 else None
+        return [message for _, message in rows], next_before_seq
+
+    def migrate_conversations_to_messages(self):
+        """
+        One-time copy of the JSON conversation blobs into conversation_messages.
+        Threads that already have messages are skipped, so it is safe to run repeatedly.
+        The copied blob is cleared in the same transaction, so the JSON column only ever holds
+        conversations that are not in conversation_messages yet.
+
+        Returns:
+        - Number of threads migrated.
+        """
+        pending_sql = '''
+        SELECT c.app_name, c.user_name, c.thread_id FROM conversations c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM conversation_messages m
+            WHERE m.app_name = c.app_name AND m.user_name = c.user_name AND m.thread_id = c.thread_id
+        )
+        '''
+        blob_sql = '''
+        SELECT conversation FROM conversations
+        WHERE app_name = ? AND user_name = ? AND thread_id = ?
+        '''
+        clear_sql = '''
+        UPDATE conversations SET conversation = N'[]'
+        WHERE app_name = ? AND user_name = ? AND thread_id = ?
+        '''
+        self.cursor.execute(pending_sql)
+        # kljucevi se citaju unapred jer pyodbc bez MARS ne moze da cita i pise istovremeno
+        pending = [tuple(row) for row in self.cursor.fetchall()]
+        migrated = 0
+        for app_name, user_name, thread_id in pending:
+            try:
+                self.cursor.execute(blob_sql, (app_name, user_name, thread_id))
+                messages = json.loads(self.cursor.fetchone()[0] or "[]")
+                self._insert_messages(app_name, user_name, thread_id, messages, 0)
+                self.cursor.execute(clear_sql, (app_name, user_name, thread_id))
+                self.conn.commit()
+                migrated += 1
+            except (pyodbc.Error, ValueError) as e:
+                print(f"Error migrating thread {thread_id}: {e}")
+                self.conn.rollback()
+        print(f"Migrated {migrated} of {len(pending)} conversations to conversation_messages.")
+        return migrated
+
+    def ensure_unique_thread_constraint(self, deduplicate=False):
+        """
+        Adds the unique constraint UQ_conversations_thread on (app_name, user_name, thread_id).
+
+        Parameters:
+        - deduplicate: Delete older duplicate rows (keeping the highest id) before adding the constraint.
+          Without it, the constraint is skipped while duplicates exist.
+
+        Returns:
+        - Boolean indicating if the constraint exists afterwards.
+        """
+        exists_sql = "SELECT 1 FROM sys.key_constraints WHERE name = 'UQ_conversations_thread'"
+        duplicates_sql = '''
+        SELECT COUNT(*) FROM (
+            SELECT 1 AS dup FROM conversations
+            GROUP BY app_name, user_name, thread_id
+            HAVING COUNT(*) > 1
+        ) AS duplicates
+        '''
+        deduplicate_sql = '''
+        WITH ranked AS (
+            SELECT ROW_NUMBER() OVER (PARTITION BY app_name, user_name, thread_id ORDER BY id DESC) AS rn
+            FROM conversations
+        )
+        DELETE FROM ranked WHERE rn > 1
+        '''
+        constraint_sql = '''
+        ALTER TABLE conversations
+        ADD CONSTRAINT UQ_conversations_thread UNIQUE (app_name, user_name, thread_id)
+        '''
+        try:
+            self.cursor.execute(exists_sql)
+            if self.cursor.fetchone():
+                return True
+            self.cursor.execute(duplicates_sql)
+            duplicates = self.cursor.fetchone()[0]
+            if duplicates:
+                if not deduplicate:
+                    print(f"{duplicates} threads have duplicate rows; UQ_conversations_thread not added.")
+                    return False
+                self.cursor.execute(deduplicate_sql)
+            self.cursor.execute(constraint_sql)
+            self.conn.commit()
+            return True
+        except pyodbc.Error as e:
+            print(f"Error adding unique constraint: {e}")
+            self.conn.rollback()
+            return False
 
 
     def query_sql_record(self, app_name, user_name, thread_id):
+        # poruke se citaju iz conversation_messages; JSON kolona je prazna za svaku nit koja je migrirana
+        # ili upisana kroz sync_messages, pa fallback vraca samo nikad migrirane niti (ili [] posle reseta)
+        messages = self.load_messages(app_name, user_name, thread_id)
+        if messages:
+            return [message for _, message in messages]
         query_sql = '''
         SELECT conversation FROM conversations 
         WHERE app_name = ? AND user_name = ? AND thread_id = ?
@@ -157,11 +397,13 @@ class ConversationDatabase:
 
     def delete_sql_record(self, app_name, user_name, thread_id):
         delete_sql = '''
+        DELETE FROM conversation_messages
+        WHERE app_name = ? AND user_name = ? AND thread_id = ?;
         DELETE FROM conversations
         WHERE app_name = ? AND user_name = ? AND thread_id = ?
         '''
         try:
-            self.cursor.execute(delete_sql, (app_name, user_name, thread_id))
+            self.cursor.execute(delete_sql, (app_name, user_name, thread_id) * 2)
             self.conn.commit()
         except Exception as e:
             print(f"Error deleting record: {e}")
@@ -223,8 +465,9 @@ class ConversationDatabase:
 
     def close(self):
         if self.conn:
-            self.conn.close()
-            print("Database connection closed.")
+            self.pool.release(self.conn)
+            self.conn = None
+            print("Database connection returned to the pool.")
 
 
 class PromptDatabase:
@@ -239,33 +482,30 @@ class PromptDatabase:
         self.user = user if user is not None else os.getenv('MSSQL_USER')
         self.password = password if password is not None else os.getenv('MSSQL_PASS')
         self.database = database if database is not None else os.getenv('MSSQL_DB')
+        self.pool = None
         self.conn = None
         self.cursor = None
         
     def __enter__(self):
         """
-        Establishes the database connection and returns the instance itself when entering the context.
+        Checks out a pooled database connection and returns the instance itself when entering the context.
         """
-        self.conn = pyodbc.connect(
-            driver='{ODBC Driver 18 for SQL Server}',
-            server=self.host,
-            database=self.database,
-            uid=self.user,
-            pwd=self.password,
-            TrustServerCertificate='yes'
-        )
+        self.pool = get_connection_pool(self.host, self.user, self.password, self.database)
+        self.conn = self.pool.acquire()
         self.cursor = self.conn.cursor()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
-        Closes the database connection and cursor when exiting the context.
+        Closes the cursor and returns the connection to the pool when exiting the context.
         Handles any exceptions that occurred within the context.
         """
         if self.cursor is not None:
             self.cursor.close()
+            self.cursor = None
         if self.conn is not None:
-            self.conn.close()
+            self.pool.release(self.conn, broken=exc_val is not None and is_broken(exc_val))
+            self.conn = None
         if exc_type or exc_val or exc_tb:
             pass
 
@@ -562,13 +802,13 @@ class PromptDatabase:
 
     def close(self):
         """
-        Closes the database connection and cursor, if they exist.
+        Closes the cursor and returns the connection to the pool, if they exist.
         """
         if self.cursor is not None:
             self.cursor.close()
             self.cursor = None
         if self.conn is not None:
-            self.conn.close()
+            self.pool.release(self.conn)
             self.conn = None
 
     def query_sql_record(self, prompt_name):
@@ -786,6 +1026,15 @@ class PromptDatabase:
             return []
 
 
+@st.cache_resource
+def ensure_schema():
+    """
+    Applies pending schema migrations once per process; returns the schema version.
+    """
+    with ConversationDatabase() as db:
+        return run_migrations(db)
+
+
 @st.cache_data
 def work_prompts():
     default_prompt = "You are a helpful assistant that always writes in Serbian."
@@ -0,0 +1,189 @@
+import os
+import threading
+import numpy as np
+import streamlit as st
+from klotbot_embeddings import get_embedding_service
+
+# Primeri pitanja po alatu; router poredi embedding pitanja sa ovim primerima.
+# Dodavanjem novih primera poboljsava se pogodak bez poziva LLM-a.
+ROUTER_EXAMPLES = {
+    "Hybrid": [
+        "Kako mogu da platim porudžbinu?",
+        "Koliko traje dostava?",
+        "Koliko košta dostava na kućnu adresu?",
+        "Kako da vratim knjigu koju sam kupio?",
+        "Koje je radno vreme vaših knjižara?",
+        "Gde se nalaze Delfi knjižare u Beogradu?",
+        "Da li imate program lojalnosti?",
+        "Kako da se registrujem na sajtu?",
+        "Da li šaljete knjige u inostranstvo?",
+        "Kako mogu da iskoristim poklon karticu?",
+    ],
+    "Opisi": [
+        "Preporuči mi knjige od Agate Kristi.",
+        "Koje knjige žanra fantastika imate?",
+        "Da li imate e-knjige od Ive Andrića?",
+        "Daj mi neki roman o ljubavi iz istorijske fantastike.",
+        "Tražim trilere koji su izašli ove godine.",
+        "Knjige o Drugom svetskom ratu za tinejdžere.",
+        "Imate li e-knjige žanra krimi?",
+        "Preporuči mi nešto od Stivena Kinga.",
+    ],
+    "Korice": [
+        "Tražim knjigu sa plavim koricama i brodom na naslovnoj strani.",
+        "Kako izgleda naslovna strana knjige Hobit?",
+        "Knjiga na čijim koricama je crvena ruža.",
+        "Imate li knjigu sa mačkom na koricama?",
+        "Sećam se samo da je na naslovnici bila devojka u žutoj haljini.",
+        "Koja knjiga ima crne korice sa zlatnim slovima?",
+    ],
+    "Graphp": [
+        "Koja je cena za Autostoperski vodič kroz galaksiju?",
+        "Pronađi knjigu Da Vinčijev kod.",
+        "Ko je napisao knjigu Piramide?",
+        "Koliko strana ima knjiga Ana Karenjina?",
+        "Koje knjige je napisao Tolkin?",
+        "Preporuči mi knjige slične knjizi Krhotine.",
+        "Da li je Na Drini ćuprija dostupna kao e-knjiga?",
+        "Kojem žanru pripada knjiga Proces?",
+    ],
+    "Pineg": [
+        "Tražim knjigu o dečaku koji odrasta na selu i sanja o moru.",
+        "Knjiga u kojoj detektiv rešava ubistvo u vozu.",
+        "Imate li nešto o putovanju kroz vreme i paralelnim svetovima?",
+        "Preporuči mi knjigu o prijateljstvu psa i deteta.",
+        "Knjiga o ženi koja napušta grad i otvara pekaru na obali.",
+        "Nešto o životu u srednjovekovnom manastiru.",
+    ],
+    "CSV": [
+        "Gde je moja porudžbina broj 123456?",
+        "Status porudžbine 987654",
+        "Da li je poslata porudžbina 5558123?",
+        "Kada stiže moja narudžbina 4455667?",
+        "Proverite porudžbinu 100234 molim vas.",
+    ],
+    "Stolag": [
+        "Da li imate Ana Karenjinu na stanju?",
+        "Da li imate Mobi Dik na stanju, treba mi 27 komada?",
+        "Koliko primeraka knjige Hobit imate na lageru?",
+        "Da li je Sto godina samoće trenutno dostupna?",
+        "Imate li na stanju Zločin i kazna i po kojoj ceni?",
+        "Koliko je trenutno na lageru knjige Majstor i Margarita?",
+    ],
+}
+
+
+class EmbeddingRouter:
+    """
+    Local tool router that picks a RAG tool by comparing the query embedding
+    with labelled example utterances, without calling a chat model.
+
+    Each tool is represented by the normalized centroid of its example embeddings.
+    The query goes to the tool with the highest cosine similarity; when that
+    similarity is below `threshold`, or too close to the runner-up (`min_margin`),
+    the decision is delegated to the fallback router (the LLM).
+
+    Attributes:
+        examples (dict): Mapping of tool name to a list of example utterances.
+        threshold (float): Minimum cosine similarity to accept a local decision.
+        min_margin (float): Minimum gap between the best and second best tool.
+        model (str): Embedding model used for examples and queries.
+
+    Example usage:
+    router = EmbeddingRouter(threshold=0.45)
+    decision = router.route("Koliko košta dostava?", fallback=get_structured_decision_from_model)
+    # {'tool': 'Hybrid', 'confidence': 0.71, 'fallback': False, 'scores': {...}}
+    """
+
+    def __init__(self, examples=None, threshold=None, min_margin=None, model="text-embedding-3-large"):
+        self.examples = examples if examples is not None else ROUTER_EXAMPLES
+        self.threshold = threshold if threshold is not None else float(os.getenv("ROUTER_THRESHOLD", 0.45))
+        self.min_margin = min_margin if min_margin is not None else float(os.getenv("ROUTER_MIN_MARGIN", 0.03))
+        self.model = model
+        self.tools = list(self.examples.keys())
+        self.centroids = None
+        self._lock = threading.Lock()
+        self._stats = {"total": 0, "local": 0, "fallback": 0}
+
+    def embed(self, texts):
+        """
+        Embeds a list of texts in a single request and returns L2-normalized rows.
+        """
+        vectors = get_embedding_service().embed_many(texts, model=self.model)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def fit(self):
+        """
+        Embeds all example utterances and builds one centroid per tool.
+        Called lazily on the first `route`.
+        """
+        texts, labels = [], []
+        for idx, tool in enumerate(self.tools):
+            texts.extend(self.examples[tool])
+            labels.extend([idx] * len(self.examples[tool]))
+        vectors = self.embed(texts)
+        labels = np.array(labels)
+        centroids = np.stack([vectors[labels == idx].mean(axis=0) for idx in range(len(self.tools))])
+        self.centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return self
+
+    def scores(self, query_vector):
+        """
+        Returns the cosine similarity of a normalized query vector to every tool centroid.
+        """
+        if self.centroids is None:
+            with self._lock:
+                if self.centroids is None:
+                    self.fit()
+        return self.centroids @ np.asarray(query_vector, dtype=np.float32)
+
+    def route(self, query, fallback=None, query_vector=None):
+        """
+        Decides which tool should answer the query.
+
+        Args:
+            query (str): The user query.
+            fallback (callable, optional): Called with the query when the local decision
+                is not confident enough; must return a tool name.
+            query_vector (array, optional): Precomputed normalized embedding of the query.
+
+        Returns:
+            dict: 'tool', 'confidence' (best cosine similarity), 'fallback' (bool) and
+                  'scores' (similarity per tool).
+        """
+        if query_vector is None:
+            query_vector = self.embed([query])[0]
+        sims = self.scores(query_vector)
+        order = np.argsort(sims)[::-1]
+        best = float(sims[order[0]])
+        margin = best - float(sims[order[1]]) if len(order) > 1 else best
+        decision = {
+            "tool": self.tools[order[0]],
+            "confidence": round(best, 4),
+            "fallback": False,
+            "scores": {tool: round(float(s), 4) for tool, s in zip(self.tools, sims)},
+        }
+        if fallback is not None and (best < self.threshold or margin < self.min_margin):
+            decision["tool"] = fallback(query)
+            decision["fallback"] = True
+
+        with self._lock:
+            self._stats["total"] += 1
+            self._stats["fallback" if decision["fallback"] else "local"] += 1
+        print(f"Router: {decision['tool']} (confidence {decision['confidence']}, fallback {decision['fallback']})")
+        return decision
+
+    def stats(self):
+        """
+        Returns routing counters and the share of queries decided locally.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["local"] / stats["total"] if stats["total"] else 0.0
+        return stats
+
+
+@st.cache_resource
+def get_router():
+    return EmbeddingRouter()
@@ -0,0 +1,333 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+import streamlit as st
+from langchain.chains.query_constructor.ir import Comparator, Comparison, Operation, Operator, StructuredQuery
+from langchain.chains.query_constructor.base import AttributeInfo
+from langchain.retrievers.self_query.base import SelfQueryRetriever
+from langchain_community.vectorstores import Pinecone as LangPine
+from langchain_openai.chat_models import ChatOpenAI
+from klotbot_embeddings import CachedEmbeddings, get_embedding_service
+from klotbot_pinecone import get_pinecone_registry
+from klotbot_text import fold
+
+# prilagoditi stvanim potrebama metadata
+METADATA_FIELD_INFO = [
+    AttributeInfo(name="authors", description="The author(s) of the document", type="string"),
+    AttributeInfo(name="category", description="The category of the document", type="string"),
+    AttributeInfo(name="chunk", description="The chunk number of the document", type="integer"),
+    AttributeInfo(name="date", description="The date of the document", type="string"),
+    AttributeInfo(name="eBook", description="Whether the document is an eBook", type="boolean"),
+    AttributeInfo(name="genres", description="The genres of the document", type="string"),
+    AttributeInfo(name="id", description="The unique ID of the document", type="string"),
+    AttributeInfo(name="text", description="The main content of the document", type="string"),
+    AttributeInfo(name="title", description="The title of the document", type="string"),
+    AttributeInfo(name="sec_id", description="The ID for the url generation", type="string"),
+]
+DOCUMENT_CONTENT_DESCRIPTION = "Content of the document"
+SELF_QUERY_MODEL = "gpt-4o"
+
+
+def schema_hash(model=SELF_QUERY_MODEL):
+    """
+    Hash of everything that shapes the structured query; cached translations expire when it changes.
+    """
+    schema = [(a.name, a.type, a.description) for a in METADATA_FIELD_INFO]
+    raw = json.dumps([schema, DOCUMENT_CONTENT_DESCRIPTION, model], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def build_self_query_retriever(index_name, namespace, model=SELF_QUERY_MODEL):
+    """
+    Builds the SelfQueryRetriever for one Pinecone namespace.
+    """
+    embeddings = CachedEmbeddings(get_embedding_service(), model="text-embedding-3-large")
+    # Prilagoditi stvanom nazivu namespace-a
+    text_key = "text" if namespace == "opisi" else "description"
+    # LangChain prihvata samo HTTP index, pa se gRPC ne koristi ovde
+    index = get_pinecone_registry().get_by_name(index_name, namespace, grpc=False)
+    vectorstore = LangPine(index, embeddings, text_key, namespace=namespace)
+    llm = ChatOpenAI(model=model, temperature=0.0)
+    return SelfQueryRetriever.from_llm(
+        llm,
+        vectorstore,
+        DOCUMENT_CONTENT_DESCRIPTION,
+        METADATA_FIELD_INFO,
+        enable_limit=True,
+        verbose=True,
+    )
+
+
+class SelfQueryRegistry:
+    """
+    Process-wide cache of SelfQueryRetriever objects, one per (index_name, namespace).
+
+    A retriever is built on first use and then shared by all sessions. Construction is
+    guarded by a per-key lock, so concurrent first requests for the same namespace build
+    it once, while different namespaces can be built in parallel.
+
+    Example usage:
+    registry = SelfQueryRegistry()
+    retriever = registry.get("delfi", "korice")
+    docs = retriever.invoke("knjige sa crvenim koricama")
+    """
+
+    def __init__(self, build=build_self_query_retriever):
+        self.build = build
+        self._retrievers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, index_name, namespace):
+        key = (index_name, namespace)
+        retriever = self._retrievers.get(key)
+        if retriever is not None:
+            return retriever
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                start = time.perf_counter()
+                retriever = self.build(index_name, namespace)
+                self._retrievers[key] = retriever
+                print(f"SelfQueryRetriever for {index_name}/{namespace} built in {time.perf_counter() - start:.3f}s")
+        return retriever
+
+    def clear(self):
+        with self._lock:
+            self._retrievers.clear()
+
+
+@st.cache_resource
+def get_self_query_registry():
+    return SelfQueryRegistry()
+
+
+def structured_query_to_dict(structured_query):
+    def visit(node):
+        if node is None:
+            return None
+        if isinstance(node, Comparison):
+            return {"comparator": node.comparator.value, "attribute": node.attribute, "value": node.value}
+        return {"operator": node.operator.value, "arguments": [visit(argument) for argument in node.arguments]}
+    return {"query": structured_query.query, "filter": visit(structured_query.filter), "limit": structured_query.limit}
+
+
+def structured_query_from_dict(data):
+    def visit(node):
+        if node is None:
+            return None
+        if "comparator" in node:
+            return Comparison(comparator=Comparator(node["comparator"]), attribute=node["attribute"], value=node["value"])
+        return Operation(operator=Operator(node["operator"]), arguments=[visit(argument) for argument in node["arguments"]])
+    return StructuredQuery(query=data["query"], filter=visit(data["filter"]), limit=data["limit"])
+
+
+def normalize_prompt(prompt):
+    return " ".join(re.findall(r"\w+", fold(prompt)))
+
+
+# e-knjiga, eknjige, ebook, elektronska izdanja... (prompt je vec normalizovan)
+EBOOK_TERMS = re.compile(r"\be ?knjig|\be ?book|\belektronsk")
+
+
+def _filter_values(node):
+    if node is None:
+        return []
+    if "comparator" in node:
+        value = node["value"]
+        return [(node["attribute"], v) for v in value] if isinstance(value, list) else [(node["attribute"], value)]
+    return [value for argument in node["arguments"] for value in _filter_values(argument)]
+
+
+def _values_in_prompt(data, prompt):
+    """
+    True if every value in the cached filter is backed by the new prompt, so "knjige od Andrica"
+    never reuses the filter of "knjige od Selimovica": strings (author, genre...) must occur in the
+    prompt, numbers must occur literally, and eBook=true/false must match whether the prompt
+    mentions e-books.
+    """
+    words = prompt.split()
+    for attribute, value in _filter_values(data["filter"]):
+        if isinstance(value, bool) or str(value).lower() in ("true", "false"):
+            if attribute == "eBook" and (str(value).lower() == "true") == bool(EBOOK_TERMS.search(prompt)):
+                continue
+            return False
+        if isinstance(value, (int, float)):
+            # 2020.0 -> "2020"; "12.5" je u normalizovanom promptu "12 5"
+            value = int(value) if float(value).is_integer() else value
+            if not all(term in words for term in normalize_prompt(str(value)).split()):
+                return False
+            continue
+        for term in normalize_prompt(str(value)).split():
+            # poredi se koren reci, da bi padezi ("Andric", "Andrica") prosli
+            if len(term) > 2 and not any(word.startswith(term[:max(2, len(term) - 2)]) for word in words):
+                return False
+    return True
+
+
+class QueryTranslationCache:
+    """
+    Memoizes the self-query LLM step: user prompt -> StructuredQuery (search text, filter, limit).
+
+    Entries are keyed by the normalized user prompt (folded, punctuation removed) and the hash of
+    the instruction prefix. On an exact miss, the most similar cached prompt (cosine similarity of
+    prompt embeddings >= `similarity`) is reused, but only if every value in its filter also occurs
+    in the new prompt; only its filter and limit are reused, and the search text is the new prompt
+    itself. Entries carry the schema hash of METADATA_FIELD_INFO and are dropped when it
+    changes. The cache is persisted to SELF_QUERY_CACHE_FILE (default 'self_query_cache.json').
+
+    Example usage:
+    cache = QueryTranslationCache()
+    structured_query = cache.translate("e-knjige zanra fantastika", instructions,
+                                       construct=lambda: retriever.query_constructor.invoke({"query": ...}))
+    cache.stats()  # {'exact_hits': 3, 'similar_hits': 1, 'misses': 2, 'entries': 5}
+    """
+
+    def __init__(self, path=None, similarity=None, maxsize=5000, embed_many=None):
+        self.path = path if path is not None else os.getenv("SELF_QUERY_CACHE_FILE", "self_query_cache.json")
+        self.similarity = similarity if similarity is not None else float(os.getenv("SELF_QUERY_SIMILARITY", 0.95))
+        self.maxsize = maxsize
+        self.embed_many = embed_many if embed_many is not None else (lambda texts: get_embedding_service().embed_many(texts))
+        self.schema = schema_hash()
+        self.entries = {}
+        self._keys, self._matrix = [], None
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "expired": 0}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Error loading self-query cache: {e}")
+            return
+        self.entries = {key: entry for key, entry in entries.items() if entry.get("schema") == self.schema}
+        self._stats["expired"] += len(entries) - len(self.entries)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.entries, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving self-query cache: {e}")
+
+    def _similar(self, key, prefix, prompt, vector):
+        with self._lock:
+            if self._matrix is None:
+                # matrica se pravi jednom (posle load); novi unosi se zatim dodaju u _add_row
+                self._keys = list(self.entries)
+                self._matrix = np.asarray(self.embed_many([self.entries[k]["prompt"] for k in self._keys])) if self._keys else None
+            keys, matrix = self._keys, self._matrix
+        if matrix is None:
+            return None
+        scores = matrix @ vector
+        for position in np.argsort(-scores):
+            if scores[position] < self.similarity:
+                break
+            if keys[position] == key or not keys[position].startswith(prefix):
+                continue
+            entry = self.entries.get(keys[position])
+            if entry is not None and _values_in_prompt(entry["structured_query"], prompt):
+                return entry
+        return None
+
+    def translate(self, prompt, instructions, construct):
+        """
+        Returns the StructuredQuery for `prompt`, calling `construct()` (the LLM) only on a miss.
+
+        Args:
+            prompt (str): The user question without the instruction prefix.
+            instructions (str): Instruction prefix sent to the query constructor.
+            construct (callable): Produces the StructuredQuery for instructions + prompt.
+        """
+        normalized = normalize_prompt(prompt)
+        prefix = hashlib.sha256(instructions.encode("utf-8")).hexdigest()[:8] + "|"
+        key = prefix + normalized
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self._stats["exact_hits"] += 1
+                entry["hits"] += 1
+                return structured_query_from_dict(entry["structured_query"])
+        vector = np.asarray(self.embed_many([normalized])[0]) if normalized else None
+        entry = self._similar(key, prefix, normalized, vector) if normalized else None
+        if entry is not None:
+            with self._lock:
+                self._stats["similar_hits"] += 1
+                entry["hits"] += 1
+            print(f"Self-query cache: '{normalized}' reuses the filter of '{entry['prompt']}'")
+            # preuzimaju se samo filter i limit; tekst pretrage je tekuce pitanje, ne tudje
+            return structured_query_from_dict(dict(entry["structured_query"], query=prompt))
+
+        structured_query = construct()
+        with self._lock:
+            self._stats["misses"] += 1
+            self.entries[key] = {"prompt": normalized, "schema": self.schema, "hits": 0, "created": time.time(),
+                                 "structured_query": structured_query_to_dict(structured_query)}
+            evicted = set()
+            if len(self.entries) > self.maxsize:
+                # izbacuju se najmanje korisceni unosi
+                evicted = set(sorted(self.entries, key=lambda k: self.entries[k]["hits"])[:len(self.entries) - self.maxsize])
+                for old_key in evicted:
+                    del self.entries[old_key]
+            self._add_row(key, vector, evicted)
+            self.save()
+        return structured_query
+
+    def _add_row(self, key, vector, evicted):
+        # poziva se pod self._lock; matrica se menja u mestu umesto da se svi promptovi ponovo embeduju
+        if self._matrix is None:
+            return
+        if evicted:
+            keep = [position for position, old_key in enumerate(self._keys) if old_key not in evicted]
+            self._keys = [self._keys[position] for position in keep]
+            self._matrix = self._matrix[keep]
+        if vector is not None and key in self.entries and key not in self._keys:
+            self._keys = self._keys + [key]
+            self._matrix = np.vstack([self._matrix, vector])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self.entries))
+
+
+@st.cache_resource
+def get_translation_cache():
+    return QueryTranslationCache()
+
+
+def translate_self_query(retriever, prompt, instructions=""):
+    """
+    Translates a prompt into the search text and vector store kwargs (Pinecone 'filter', 'k')
+    of a SelfQueryRetriever, with the structured query taken from the translation cache.
+    """
+    query = instructions + prompt
+    structured_query = get_translation_cache().translate(
+        prompt, instructions, lambda: retriever.query_constructor.invoke({"query": query})
+    )
+    new_query, new_kwargs = retriever.structured_query_translator.visit_structured_query(structured_query)
+    if structured_query.limit is not None:
+        new_kwargs["k"] = structured_query.limit
+    if getattr(retriever, "use_original_query", False):
+        new_query = query
+    return new_query, {**retriever.search_kwargs, **new_kwargs}
+
+
+def run_self_query(retriever, prompt, instructions=""):
+    """
+    Runs a SelfQueryRetriever with the structured query taken from the translation cache.
+    Mirrors SelfQueryRetriever's own retrieval using only its public attributes.
+    """
+    new_query, search_kwargs = translate_self_query(retriever, prompt, instructions)
+    return retriever.vectorstore.search(new_query, retriever.search_type, **search_kwargs)
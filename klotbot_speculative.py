@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+
+class SpeculativeRetriever:
+    """
+    Runs the most likely retrieval tools concurrently with the routing decision.
+
+    While the router decides, the `candidates` tools (by default Hybrid and Pineg) are started
+    on a shared thread pool. The result of the tool the router picks is used; the others are
+    cancelled if they have not started yet, or their results are discarded and counted as
+    wasted work. At most `max_inflight` speculative tasks run at once across all sessions;
+    above that, turns fall back to the sequential path.
+
+    Attributes:
+        candidates (list): Tool names started speculatively.
+        max_inflight (int): Concurrency cap for speculative tasks.
+
+    Example usage:
+    retriever = SpeculativeRetriever(candidates=["Hybrid", "Pineg"], max_inflight=8)
+    tool, context = retriever.run(prompt, route=choose_tool, tools={"Hybrid": hybrid, ...})
+    """
+
+    def __init__(self, candidates=None, max_inflight=None):
+        if candidates is None:
+            candidates = [t.strip() for t in os.getenv("SPECULATIVE_TOOLS", "Hybrid,Pineg").split(",") if t.strip()]
+        self.candidates = candidates
+        self.max_inflight = max_inflight if max_inflight is not None else int(os.getenv("SPECULATIVE_MAX_INFLIGHT", 8))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix="speculative")
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._stats = {"turns": 0, "started": 0, "used": 0, "cancelled": 0, "discarded": 0,
+                       "skipped": 0, "wasted_seconds": 0.0}
+
+    def _submit(self, func, prompt):
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                self._stats["skipped"] += 1
+                return None
+            self._inflight += 1
+            self._stats["started"] += 1
+
+        elapsed = [0.0]
+
+        def timed():
+            start = time.perf_counter()
+            try:
+                return func(prompt)
+            finally:
+                elapsed[0] = time.perf_counter() - start
+
+        future = self.executor.submit(timed)
+        future.elapsed = elapsed
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._lock:
+            self._inflight -= 1
+
+    def _discard(self, future):
+        if future.cancel():
+            with self._lock:
+                self._stats["cancelled"] += 1
+            return
+
+        def account(done):
+            with self._lock:
+                self._stats["discarded"] += 1
+                self._stats["wasted_seconds"] += done.elapsed[0]
+
+        future.add_done_callback(account)
+
+    def run(self, prompt, route, tools):
+        """
+        Routes the prompt and returns the chosen tool's context.
+
+        Args:
+            prompt (str): The user query.
+            route (callable): Returns the tool name for the prompt; runs in the calling thread.
+            tools (dict): Mapping of tool name to a callable taking the prompt and returning context.
+
+        Returns:
+            tuple: (tool, context). Context is " " for an unknown tool.
+        """
+        futures = {}
+        for tool in self.candidates:
+            if tool in tools:
+                future = self._submit(tools[tool], prompt)
+                if future is not None:
+                    futures[tool] = future
+
+        try:
+            tool = route(prompt)
+        except Exception:
+            for future in futures.values():
+                self._discard(future)
+            raise
+
+        chosen = futures.pop(tool, None)
+        for future in futures.values():
+            self._discard(future)
+        with self._lock:
+            self._stats["turns"] += 1
+            if chosen is not None:
+                self._stats["used"] += 1
+
+        if chosen is not None:
+            return tool, chosen.result()
+        if tool in tools:
+            return tool, tools[tool](prompt)
+        return tool, " "
+
+    def stats(self):
+        """
+        Returns speculation counters; 'waste_ratio' is the share of started tasks not used.
+        """
+        with self._lock:
+            stats = dict(self._stats, inflight=self._inflight)
+        stats["waste_ratio"] = (stats["cancelled"] + stats["discarded"]) / stats["started"] if stats["started"] else 0.0
+        return stats
+
+
+@st.cache_resource
+def get_speculative_retriever():
+    return SpeculativeRetriever()
@@ -0,0 +1,29 @@
+import re
+import unicodedata
+
+# Zajednicke funkcije za srpski tekst (Cypher slotovi, BM25, self-query kes, fulltext upiti)
+
+SERBIAN_ENDINGS = ("ama", "ima", "om", "em", "oj", "u", "a", "e", "i", "o")
+
+
+def fold(text):
+    """
+    Lowercases and strips diacritics the same way the Neo4j 'standard-folding' analyzer does.
+    """
+    text = text.lower().replace("đ", "d")
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def stem_terms(text):
+    """
+    Splits text into lowercase word stems with common Serbian case endings removed.
+    """
+    terms = []
+    for word in re.findall(r"\w+", text.lower()):
+        if len(word) > 3:
+            for ending in SERBIAN_ENDINGS:
+                if word.endswith(ending) and len(word) - len(ending) >= 3:
+                    word = word[:-len(ending)]
+                    break
+        terms.append(word)
+    return terms
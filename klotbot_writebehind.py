@@ -0,0 +1,209 @@
+import atexit
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+import streamlit as st
+from klotbot_promptdb import ConversationDatabase
+
+
+def save_batch(batch):
+    """
+    Writes a batch of (app_name, user_name, thread_id, messages, rewrite) over one pooled
+    connection. Returns one success flag per item.
+    """
+    with ConversationDatabase() as db:
+        return [db.sync_messages(app_name, user_name, thread_id, messages, rewrite=rewrite) is not None
+                for app_name, user_name, thread_id, messages, rewrite in batch]
+
+
+class ConversationWriter:
+    """
+    Write-behind queue for conversation saves.
+
+    `mark_dirty` is called on every Streamlit rerun and returns immediately. A thread whose
+    messages did not change since the last save is not queued at all; repeated updates of the
+    same thread before a flush are coalesced into the latest snapshot; if any of them was not an
+    extension of the previous one (the conversation was reset), the coalesced entry is written as
+    a full rewrite of the thread. A background thread
+    writes pending threads in batches every `interval` seconds (or as soon as `batch_size`
+    threads are pending), and once more at interpreter shutdown.
+
+    Memory is bounded: at most `max_pending` threads wait in the queue (further `mark_dirty`
+    calls for new threads wait up to `block_timeout` seconds for the writer to catch up, then
+    the save is dropped and logged), and change signatures are kept for the `max_pending` most
+    recent threads.
+
+    Attributes:
+        interval (float): Seconds between flushes (CONVERSATION_FLUSH_INTERVAL, default 2).
+        max_pending (int): Queue bound in threads (CONVERSATION_MAX_PENDING, default 1000).
+        block_timeout (float): Longest wait of `mark_dirty` on a full queue (CONVERSATION_BLOCK_TIMEOUT, default 1).
+
+    Example usage:
+    writer = ConversationWriter()
+    writer.mark_dirty("KlotBot", "positive", thread_id, st.session_state.messages[thread_id])
+    writer.flush_now(timeout=5)  # kada upis mora da bude zavrsen, npr. pre citanja niti
+    writer.stats()  # {'marked': 40, 'unchanged': 31, 'coalesced': 4, 'written': 5, 'batches': 2, ...}
+    """
+
+    def __init__(self, save=save_batch, interval=None, max_pending=None, batch_size=50, block_timeout=None):
+        self.save = save
+        self.interval = interval if interval is not None else float(os.getenv("CONVERSATION_FLUSH_INTERVAL", 2))
+        self.max_pending = max_pending if max_pending is not None else int(os.getenv("CONVERSATION_MAX_PENDING", 1000))
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout if block_timeout is not None else float(os.getenv("CONVERSATION_BLOCK_TIMEOUT", 1))
+        self._pending = OrderedDict()  # key -> (seq, messages, rewrite), najstariji prvi
+        self._inflight = {}  # key -> seq, batch koji se upravo upisuje
+        self._signatures = OrderedDict()  # key -> (broj poruka, poslednja poruka) poslednjeg snimka
+        self._seq = itertools.count(1)
+        self._last_seq = 0
+        self._flush_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._stats = {"marked": 0, "unchanged": 0, "coalesced": 0, "written": 0, "failed": 0,
+                       "batches": 0, "blocked": 0, "dropped": 0, "rewrites": 0, "write_seconds": 0.0}
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def mark_dirty(self, app_name, user_name, thread_id, messages):
+        """
+        Queues the thread for saving if its messages changed. Returns True if it was queued,
+        False if nothing changed or the queue stayed full for `block_timeout` seconds.
+
+        Args:
+            app_name (str): The name of the application.
+            user_name (str): The name of the user.
+            thread_id (str): The thread identifier.
+            messages (list): The full conversation; a shallow copy is queued.
+        """
+        key = (app_name, user_name, thread_id)
+        signature = (len(messages), messages[-1] if messages else None)
+        with self._condition:
+            self._stats["marked"] += 1
+            previous = self._signatures.get(key)
+            if previous == signature:
+                self._stats["unchanged"] += 1
+                return False
+            # nova lista nije nastavak prethodnog snimka (manje poruka ili druga poruka na istom mestu)
+            rewrite = previous is not None and (len(messages) < previous[0] or
+                                                (previous[0] > 0 and messages[previous[0] - 1] != previous[1]))
+            if key in self._pending:
+                self._stats["coalesced"] += 1
+                rewrite = rewrite or self._pending[key][2]
+            elif len(self._pending) >= self.max_pending:
+                self._stats["blocked"] += 1
+                self._flush_requested = True
+                self._condition.notify_all()
+                if not self._condition.wait_for(lambda: len(self._pending) < self.max_pending or self._closed,
+                                                self.block_timeout):
+                    self._stats["dropped"] += 1
+                    print(f"Conversation writer queue full, save of thread {thread_id} dropped.")
+                    return False
+            self._signatures[key] = signature
+            self._signatures.move_to_end(key)
+            while len(self._signatures) > self.max_pending:
+                self._signatures.popitem(last=False)
+            seq = next(self._seq)
+            self._last_seq = seq
+            # stari snimak iste niti se zamenjuje, a nit zadrzava mesto u redu
+            self._pending[key] = (seq, list(messages), rewrite)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+            return True
+
+    def _oldest_unwritten(self):
+        seqs = [seq for seq, _, _ in self._pending.values()] + list(self._inflight.values())
+        return min(seqs) if seqs else None
+
+    def flush_now(self, timeout=None):
+        """
+        Writes everything marked so far and waits for it. Returns False on timeout.
+        """
+        with self._condition:
+            target = self._last_seq
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: (self._oldest_unwritten() or target + 1) > target, timeout
+            )
+
+    def _take_batch(self):
+        # poziva se pod self._condition
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            key, (seq, messages, rewrite) = self._pending.popitem(last=False)
+            self._inflight[key] = seq
+            batch.append((key, seq, messages, rewrite))
+        return batch
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            results = self.save([key + (messages, rewrite) for key, _, messages, rewrite in batch])
+        except Exception as e:
+            print(f"Error saving conversations: {e}")
+            results = [False] * len(batch)
+        elapsed = time.perf_counter() - start
+        with self._condition:
+            self._stats["batches"] += 1
+            self._stats["write_seconds"] += elapsed
+            for (key, seq, messages, rewrite), ok in zip(batch, results):
+                self._inflight.pop(key, None)
+                if ok:
+                    self._stats["written"] += 1
+                    self._stats["rewrites"] += rewrite
+                    continue
+                self._stats["failed"] += 1
+                # neuspeli upis se vraca u red ako u medjuvremenu nije stigao noviji snimak;
+                # noviji snimak nasledjuje zahtev za prepisivanje niti
+                if key not in self._pending:
+                    self._pending[key] = (seq, messages, rewrite)
+                    self._pending.move_to_end(key, last=False)
+                elif rewrite:
+                    newer_seq, newer_messages, _ = self._pending[key]
+                    self._pending[key] = (newer_seq, newer_messages, True)
+                self._signatures.pop(key, None)
+            self._condition.notify_all()
+        return all(results)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or self._flush_requested or len(self._pending) >= self.batch_size,
+                    self.interval,
+                )
+                self._flush_requested = False
+                closing = self._closed
+            # red se prazni u batch-evima; posle neuspeha se ceka sledeci interval
+            while True:
+                with self._condition:
+                    batch = self._take_batch()
+                if not batch or not self._write(batch):
+                    break
+            if closing:
+                return
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats, pending=len(self._pending), inflight=len(self._inflight))
+
+    def close(self, timeout=10):
+        """
+        Flushes pending saves and stops the writer thread (registered with atexit).
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self._pending:
+            print(f"Conversation writer stopped with {len(self._pending)} unsaved threads.")
+
+
+@st.cache_resource
+def get_conversation_writer():
+    return ConversationWriter()
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from klotbot_ann import LocalVectorIndex, truncate
+
+# Poredjenje recall-a i latencije lokalnog ANN indeksa za pune i skracene embedding-e.
+# Pre pokretanja: python klotbot_ann.py opisi --dims 256,512,1024
+# Pokretanje:     python various/ann_dimension_report.py --namespace opisi --questions pitanja.txt
+#                 python various/ann_dimension_report.py --namespace opisi --sample 200
+
+
+def exact_top_k(vectors, query, top_k, chunk=65536):
+    scores = np.concatenate([vectors[start:start + chunk] @ query for start in range(0, len(vectors), chunk)])
+    best = np.argpartition(-scores, top_k)[:top_k]
+    return best[np.argsort(-scores[best])]
+
+
+def load_queries(args, store):
+    if args.questions:
+        from klotbot_embeddings import get_embedding_service
+        with open(args.questions, "r", encoding="utf-8") as file:
+            questions = [line.strip() for line in file if line.strip()]
+        return get_embedding_service().embed_many(questions)
+    # bez pitanja koristimo nasumicne vektore iz kataloga sa malo suma
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(len(store["vectors"]), args.sample, replace=False))
+    queries = np.asarray(store["vectors"][rows], dtype=np.float32)
+    queries += rng.normal(0, 0.01, queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run(index, namespace, queries, truth, ids, top_k, dimensions, rescore):
+    latencies, recall = [], 0.0
+    for query, expected in zip(queries, truth):
+        vector = query if rescore or not dimensions else truncate(query, dimensions)
+        start = time.perf_counter()
+        matches = index.query(vector=vector, top_k=top_k, namespace=namespace, include_metadata=False).to_dict()["matches"]
+        latencies.append(time.perf_counter() - start)
+        recall += len({m["id"] for m in matches} & {ids[row] for row in expected}) / top_k
+    latencies = np.array(latencies) * 1000
+    return recall / len(queries), np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--namespace", default="opisi")
+    parser.add_argument("--questions", help="fajl sa pitanjima, jedno po redu")
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=int(os.getenv("ANN_NPROBE", 16)))
+    parser.add_argument("--rescore", type=int, default=50)
+    parser.add_argument("--output", help="upisi izvestaj i u markdown fajl")
+    args = parser.parse_args()
+
+    base = LocalVectorIndex(nprobe=args.nprobe)
+    store = base._store(args.namespace)
+    if store is None:
+        sys.exit(f"Namespace '{args.namespace}' nije eksportovan")
+    ids = list(base._rows_by_id(store))  # redosled je redosled redova u vectors.npy
+    queries = load_queries(args, store)
+    truth = [exact_top_k(store["vectors"], query, args.top_k) for query in queries]
+    full = store["vectors"].shape[1]
+
+    lines = [
+        f"Namespace {args.namespace}: {len(ids)} vektora, {len(queries)} upita, top_k={args.top_k}, nprobe={args.nprobe}",
+        "",
+        "| dimenzije | rescoring | recall@k | p50 ms | p95 ms | bajtova/vektor |",
+        "|---|---|---|---|---|---|",
+    ]
+    configs = [(0, False)] + [(size, rescore) for size in sorted(store["truncated"]) for rescore in (False, True)]
+    for dimensions, rescore in configs:
+        index = LocalVectorIndex(nprobe=args.nprobe, search_dimensions=dimensions, rescore_candidates=args.rescore)
+        recall, p50, p95 = run(index, args.namespace, queries, truth, ids, args.top_k, dimensions, rescore)
+        label = dimensions or full
+        lines.append(f"| {label} | {f'da ({args.rescore})' if rescore else 'ne'} | {recall:.3f} | {p50:.2f} | {p95:.2f} | {label * 4} |")
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
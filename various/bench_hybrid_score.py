@@ -0,0 +1,64 @@
+import random
+import time
+import timeit
+import tracemalloc
+import numpy as np
+
+# Mikrobenchmark hibridnog skoriranja: stari put (liste) i novi put (float32 nizovi).
+# Meri CPU vreme po upitu i alokacije od embedding-a do parametara za Pinecone query.
+# Pokretanje: python various/bench_hybrid_score.py
+
+dimensions = 3072        # text-embedding-3-large
+sparse_terms = 12        # tipican broj BM25 termina u upitu
+alpha = 0.5
+repeats = 2000
+
+random.seed(0)
+api_embedding = [random.uniform(-0.05, 0.05) for _ in range(dimensions)]
+cached_embedding = np.asarray(api_embedding, dtype=np.float32)
+cached_embedding.flags.writeable = False
+sparse = {"indices": random.sample(range(2 ** 31), sparse_terms),
+          "values": [random.uniform(0.1, 2.0) for _ in range(sparse_terms)]}
+
+
+def list_path():
+    """Pre: embedding stize kao lista float-ova i kopira se kroz list comprehension."""
+    dense = list(api_embedding)  # OpenAI SDK vraca novu listu za svaki upit
+    hdense = [v * alpha for v in dense]
+    hsparse = {"indices": sparse["indices"], "values": [v * (1 - alpha) for v in sparse["values"]]}
+    return {"vector": hdense, "sparse_vector": hsparse}
+
+
+def array_path():
+    """Posle: kesirani float32 niz, vektorsko mnozenje i jedna konverzija na granici klijenta."""
+    a = np.float32(alpha)
+    hdense = cached_embedding * a
+    values = np.asarray(sparse["values"], dtype=np.float32) * (np.float32(1) - a)
+    return {"vector": hdense.tolist(), "sparse_vector": {"indices": sparse["indices"], "values": values.tolist()}}
+
+
+def measure(name, func):
+    func()
+    cpu_start = time.process_time()
+    wall = timeit.timeit(func, number=repeats)
+    cpu = time.process_time() - cpu_start
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    result = func()
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = snapshot_after.compare_to(snapshot_before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    retained = sum(stat.size_diff for stat in stats)
+    del result
+
+    print(f"{name:>6}: {cpu / repeats * 1e6:8.1f} us CPU/upit, {wall / repeats * 1e6:8.1f} us wall/upit, "
+          f"peak {peak / 1024:7.1f} KiB, zadrzano {retained / 1024:7.1f} KiB u {blocks} blokova")
+
+
+if __name__ == "__main__":
+    print(f"dimenzije={dimensions}, sparse termina={sparse_terms}, ponavljanja={repeats}")
+    measure("liste", list_path)
+    measure("numpy", array_path)
@@ -0,0 +1,67 @@
+import argparse
+import os
+import sys
+import time
+import uuid
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from klotbot_promptdb import ConversationDatabase
+
+# Poredjenje cuvanja konverzacije: stari put (SELECT COUNT + UPDATE/INSERT, dva commit-a)
+# i novi upsert u jednom batch-u. Radi nad pravom bazom iz MSSQL_* promenljivih,
+# sa privremenim app_name koji se na kraju brise.
+# Pokretanje: python various/bench_upsert.py --threads 20 --rounds 10 --messages 30
+
+
+def two_step(db, app_name, user_name, thread_id, conversation):
+    if db.record_exists(app_name, user_name, thread_id):
+        db.update_sql_record(app_name, user_name, thread_id, conversation)
+        return "updated"
+    db.add_sql_record(app_name, user_name, thread_id, conversation)
+    return "inserted"
+
+
+def run(db, save, app_name, threads, rounds, conversation):
+    latencies, outcomes = [], {"inserted": 0, "updated": 0, None: 0}
+    for _ in range(rounds):
+        for thread in range(threads):
+            start = time.perf_counter()
+            outcome = save(db, app_name, "bench", f"Thread_{thread}", conversation)
+            latencies.append(time.perf_counter() - start)
+            outcomes[outcome] += 1
+    latencies = np.array(latencies) * 1000
+    return latencies, outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=30)
+    args = parser.parse_args()
+
+    conversation = [{"role": "user" if i % 2 else "assistant", "content": "Poruka " * 40} for i in range(args.messages)]
+    methods = {
+        "SELECT + UPDATE/INSERT": two_step,
+        "upsert (jedan batch)": lambda db, *record: db.upsert_sql_record(*record),
+    }
+    print(f"{args.threads} niti x {args.rounds} rundi, {args.messages} poruka po konverzaciji")
+    print("| metod | p50 ms | p95 ms | ukupno s | inserted | updated | greske |")
+    print("|---|---|---|---|---|---|---|")
+    with ConversationDatabase() as db:
+        db.create_sql_table()
+        for label, save in methods.items():
+            # svaki metod dobija svoj app_name, pa prva runda meri insert, ostale update
+            app_name = f"bench_upsert_{uuid.uuid4().hex[:8]}"
+            try:
+                latencies, outcomes = run(db, save, app_name, args.threads, args.rounds, conversation)
+            finally:
+                db.cursor.execute("DELETE FROM conversations WHERE app_name = ?", (app_name,))
+                db.conn.commit()
+            print(f"| {label} | {np.percentile(latencies, 50):.2f} | {np.percentile(latencies, 95):.2f} | "
+                  f"{latencies.sum() / 1000:.2f} | {outcomes['inserted']} | {outcomes['updated']} | {outcomes[None]} |")
+
+
+if __name__ == "__main__":
+    main()
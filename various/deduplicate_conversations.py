@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from klotbot_promptdb import ConversationDatabase
+
+# Brisanje duplih redova u conversations (ostaje red sa najvecim id) i dodavanje UQ_conversations_thread.
+# Migracija 2 u klotbot_migrations ne brise podatke i preskace se dok duplikati postoje; pre pokretanja
+# napraviti backup tabele conversations. Posle skripte se migracija 2 belezi kao primenjena.
+# Pokretanje: python various/deduplicate_conversations.py
+
+if __name__ == "__main__":
+    with ConversationDatabase() as db:
+        if db.ensure_unique_thread_constraint(deduplicate=True):
+            print("UQ_conversations_thread is in place.")
+            print(f"Schema version: {db.create_sql_table()}")
+        else:
+            print("Could not add UQ_conversations_thread.")
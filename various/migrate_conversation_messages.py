@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from klotbot_promptdb import ConversationDatabase
+
+# Jednokratno prebacivanje JSON konverzacija iz conversations.conversation u conversation_messages.
+# Migracija 4 u klotbot_migrations to radi pri startu aplikacije; skripta ponavlja kopiranje
+# za niti koje su u medjuvremenu upisane starim kodom. Niti koje vec imaju poruke se preskacu.
+# Pokretanje: python various/migrate_conversation_messages.py
+
+if __name__ == "__main__":
+    with ConversationDatabase() as db:
+        db.create_sql_table()
+        db.migrate_conversations_to_messages()